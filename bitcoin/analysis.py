@@ -2,10 +2,17 @@
 This module contains various helpers methods to extract statistics from the nodes dumped after a simulation run.
 """
 
-from typing import List, Dict
+from typing import List, Dict, Sequence, Set, Tuple
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
 import math
+import pickle
 import sys
 
+import numpy as np
+
 sys.path.append("..")
 
 from bitcoin.models import Miner, Block
@@ -13,31 +20,137 @@ from bitcoin.models import Miner, Block
 from bitcoin.bookkeeper import *
 
 
+class ChainIndex:
+    """
+    Block tree built once from a set of blocks, answering main-chain, orphan, fork and reward queries without rescanning the blocks.
+
+    Blocks whose parent is not in the set (e.g. children of the genesis block) are roots of the tree.
+    """
+
+    def __init__(self, blocks: Dict[int, Block]):
+        """
+        Build the index in time linear in the number of blocks.
+        * blocks (Dict[int, Block]): All blocks, with block ids as keys.
+        """
+        self.blocks = blocks
+        self.children: Dict[int, List[int]] = dict()
+        """Ids of the child blocks of each block that has children."""
+        self.heights: Dict[int, List[Block]] = dict()
+        """Blocks at each height."""
+        self.roots: List[Block] = []
+        head = None
+        for block in blocks.values():
+            if block.prev_id in blocks:
+                self.children.setdefault(block.prev_id, []).append(block.id)
+            else:
+                self.roots.append(block)
+            self.heights.setdefault(block.height, []).append(block)
+            if head is None or block.height > head.height:
+                head = block
+        self.head: Block = head
+
+        self.main_chain: List[Block] = []
+        """Blocks in the longest chain, from the head down."""
+        while head is not None:
+            self.main_chain.append(head)
+            head = blocks.get(head.prev_id, None)
+        self.main_ids: Set[int] = {block.id for block in self.main_chain}
+
+        self.fork_depth: Dict[int, int] = dict()
+        """Number of blocks between each block and the main chain, including the block itself (0 for main-chain blocks)."""
+        self.fork_lengths: Dict[int, int] = dict()
+        """Length of each fork, with the id of its first block as key."""
+        fork_roots: Dict[int, int] = dict()
+        stack = [block.id for block in self.roots]
+        while stack:
+            block_id = stack.pop()
+            parent_id = blocks[block_id].prev_id
+            if block_id in self.main_ids:
+                self.fork_depth[block_id] = 0
+            else:
+                depth = self.fork_depth.get(parent_id, 0) + 1
+                self.fork_depth[block_id] = depth
+                fork_root = block_id if depth == 1 else fork_roots[parent_id]
+                fork_roots[block_id] = fork_root
+                self.fork_lengths[fork_root] = max(self.fork_lengths.get(fork_root, 0), depth)
+            stack.extend(self.children.get(block_id, []))
+        self.orphans: Set[int] = set(fork_roots)
+        """Ids of the blocks not in the main chain."""
+
+        self.rewards: Dict[str, float] = dict()
+        """Total main-chain rewards of each miner."""
+        for block in self.main_chain:
+            self.rewards[block.miner] = self.rewards.get(block.miner, 0) + block.reward.value
+
+    def is_main(self, block_id: int) -> bool:
+        """
+        Returns whether the block with the given id is in the main chain.
+        """
+        return block_id in self.main_ids
+
+    def blocks_at(self, height: int) -> List[Block]:
+        """
+        Returns the blocks at the given height.
+        """
+        return self.heights.get(height, [])
+
+    def fork_length_histogram(self) -> Dict[int, int]:
+        """
+        Returns the number of forks of each length, with lengths as keys.
+        """
+        return dict(Counter(self.fork_lengths.values()))
+
+    def miner_reward(self, miner: str) -> float:
+        """
+        Returns the total main-chain reward of the miner with the given name.
+        """
+        return self.rewards.get(miner, 0)
+
+
 class Analysis:
     def __init__(self, bookkeeper: Bookkeeper, nodes: List[Node]) -> None:
         self.nodes = nodes
         self.bookkeeper = bookkeeper
+        self.all_blocks: Dict[int, Block] = None
+        self.chain_index: ChainIndex = None
+        self.sorted_delays: np.ndarray = None
+        """Propagation delays with one row per block (in `get_all_blocks` order), sorted along each row."""
 
-    def get_all_blocks(self) -> Dict[str, Block]:
+    def get_all_blocks(self) -> Dict[int, Block]:
         """
-        Returns list of all blocks seen by all the nodes.
+        Returns list of all blocks seen by all the nodes. The result is cached and must not be modified.
         nodes (List[Node]): List of nodes in the simulation.
         """
-        blocks = dict()
-        for node in self.nodes:
-            for _, block in node.blockchain.items():
-                if block != 'placeholder' and block.created_at != 0:
-                    blocks[block.id] = block
-        return blocks
+        if self.all_blocks is None:
+            blocks = dict()
+            for node in self.nodes:
+                for _, block in node.blockchain.items():
+                    if block != 'placeholder' and block.created_at != 0:
+                        blocks[block.id] = block
+            self.all_blocks = blocks
+        return self.all_blocks
 
-    def get_longest_chain(self, blocks: Dict[str, Block]) -> List[Block]:
+    def get_chain_index(self) -> ChainIndex:
+        """
+        Returns the `ChainIndex` of all blocks. The result is cached.
+        """
+        if self.chain_index is None:
+            self.chain_index = ChainIndex(self.get_all_blocks())
+        return self.chain_index
+
+    def get_main_chain(self) -> List[Block]:
+        """
+        Returns the list of blocks in the longest chain among all blocks, from the head down. The result is cached and must not be modified.
+        """
+        return self.get_chain_index().main_chain
+
+    def get_longest_chain(self, blocks: Dict[int, Block]) -> List[Block]:
         """
         Computes and returns the list of blocks in the longest chain.
-        * blocks (Dict[str, Block]): List of all mined blocks.
+        * blocks (Dict[int, Block]): List of all mined blocks.
         """
         chain = []
-        heights = [block.height for block in blocks.values()]
-        head = list(blocks.values())[heights.index(max(heights))]
+        head = max(blocks.values(), key=lambda block: block.height)
         while head is not None:
             chain.append(head)
             head = blocks.get(head.prev_id, None)
@@ -49,6 +162,9 @@ class Analysis:
         * block (Block): Block to calculate propagation times for.
         * nodes (List[Node]): List of all nodes.
         """
+        if isinstance(self.bookkeeper, ArrayBookkeeper):
+            rcvs = self.bookkeeper.get_block_rcvs(block, self.nodes).tolist()
+            return [(2**64 if rcv == ArrayBookkeeper.MISSING else rcv) - block.created_at for rcv in rcvs]
         return [self.bookkeeper.get_node_block_rcv(node, block) - block.created_at for node in self.nodes]
 
     def block_percentile_delay(self, block: Block, percent: float) -> int:
@@ -64,7 +180,45 @@ class Analysis:
         result = delays[nodes_required - 1]
         if result > 2 ** 50:  # did not reach that percentage of nodes
             return None
-        return sorted(delays)[nodes_required - 1]
+        return result
+
+    def percentile_delays(self, percents: Sequence[float] = (0.5, 0.9, 0.99)) -> Dict[float, np.ndarray]:
+        """
+        Calculates, for all blocks at once, the time it takes for each block to reach the given percents of the nodes.
+        Returns an array per percent, aligned with `get_all_blocks().values()`, with NaN for blocks that did not reach that percentage.
+        * percents (Sequence[float]): Shares of nodes to calculate delays for.
+        """
+        sorted_delays = self.get_sorted_delays()
+        curves = dict()
+        for percent in percents:
+            nodes_required = math.ceil(percent * len(self.nodes))
+            curve = sorted_delays[:, nodes_required - 1].copy()
+            curve[np.isinf(curve)] = np.nan
+            curves[percent] = curve
+        return curves
+
+    def get_sorted_delays(self) -> np.ndarray:
+        """
+        Returns the propagation delays of all blocks to all nodes as a matrix with one row per block (in `get_all_blocks` order),
+        each row sorted in increasing order. Nodes that did not receive a block have an infinite delay. The result is cached.
+        """
+        if self.sorted_delays is None:
+            blocks = list(self.get_all_blocks().values())
+            if isinstance(self.bookkeeper, ArrayBookkeeper):
+                rcvs = self.bookkeeper.get_rcv_matrix(blocks, self.nodes).astype(np.float64)
+                rcvs[rcvs == float(ArrayBookkeeper.MISSING)] = np.inf
+            else:
+                block_rows = {block.id: row for row, block in enumerate(blocks)}
+                rcvs = np.full((len(blocks), len(self.nodes)), np.inf)
+                for column, node in enumerate(self.nodes):
+                    for block_id, timestamp in self.bookkeeper.get_node_block_rcvs(node).items():
+                        row = block_rows.get(block_id, None)
+                        if row is not None:
+                            rcvs[row, column] = timestamp
+            delays = rcvs - np.array([block.created_at for block in blocks], dtype=np.float64)[:, np.newaxis]
+            delays.sort(axis=1)
+            self.sorted_delays = delays
+        return self.sorted_delays
 
     # given a node, returns share of blocks that are not built upon
     def stale_block_rate(self, node: Miner) -> float:
@@ -72,20 +226,25 @@ class Analysis:
         Given a node, returns the share of orphan blocks from that node's point of view.
         * node (Miner): Node to calculate stale rate for.
         """
-        all_blocks = self.get_all_blocks()
-        total_count = len(all_blocks)
-        main_count = len(self.get_longest_chain(all_blocks))
-        return (total_count - main_count) / total_count
+        return len(self.get_chain_index().orphans) / len(self.get_all_blocks())
 
     def reward_distribution(self) -> Dict[Miner, int]:
         """
         Returns the total mining rewards collected for each miner as a dictionary with miner names as keys.
         """
-        rewards = dict()
-        main_chain = self.get_longest_chain(self.get_all_blocks())
-        for block in main_chain:
-            rewards[block.miner] = rewards.get(block.miner, 0) + block.reward.value
-        return rewards
+        return dict(self.get_chain_index().rewards)
+
+    def summary(self, percents: Sequence[float] = (0.5, 0.9, 0.99)) -> dict:
+        """
+        Returns the percentile delay curves (see `percentile_delays`), the stale block rate and the reward distribution in one dictionary.
+        * percents (Sequence[float]): Shares of nodes to calculate delays for.
+        """
+        total_count = len(self.get_all_blocks())
+        return {
+            'percentile_delays': self.percentile_delays(percents),
+            'stale_rate': len(self.get_chain_index().orphans) / total_count if total_count else 0.0,
+            'rewards': self.reward_distribution(),
+        }
 
     def transactions_per_second(self, blocks: List[Block], sim_seconds: int) -> float:
         """
@@ -110,3 +269,116 @@ class Analysis:
             total += head.created_at - block.created_at
             head = block
         return total / count
+
+
+def load_rep(location: str) -> Tuple[Bookkeeper, List[Miner]]:
+    """
+    Loads the bookkeeper and the nodes of a repetition dumped with `results_format: pickle`.
+    With `bookkeeping: stream`, the returned bookkeeper is a regular `Bookkeeper` holding the block receipts of the event log.
+    * location (str): Directory of the repetition (`{results_dir}/{sim_name}_{rep}`).
+    """
+    with open(f'{location}/bookkeeper', 'rb') as f:
+        bookkeeper = pickle.load(f)
+    if isinstance(bookkeeper, StreamingBookkeeper):
+        bookkeeper = StreamingBookkeeper.load(f'{location}/events.bin')
+    nodes = []
+    for filename in _node_files(location):
+        with open(f'{location}/{filename}', 'rb') as f:
+            nodes.append(pickle.load(f))
+    block_store = _load_block_store(location)
+    if block_store is not None:
+        block_store.attach(nodes)
+    return bookkeeper, nodes
+
+
+def load_blocks(location: str, workers: int = None) -> Dict[int, Block]:
+    """
+    Loads all blocks seen by the nodes of a repetition, unpickling the node files on a process pool (in this process with one worker).
+    Each process merges the blockchains of its share of the nodes by block id; the blocks themselves are then taken from the block store.
+    * location (str): Directory of the repetition (`{results_dir}/{sim_name}_{rep}`).
+    * workers (int): Number of processes. Defaults to the number of CPUs.
+    """
+    filenames = _node_files(location)
+    workers = min(workers or os.cpu_count(), max(len(filenames), 1))
+    chunks = [[f'{location}/{filename}' for filename in filenames[idx::workers]] for idx in range(workers)]
+    if workers == 1:
+        blocks = _load_chunk_blocks(chunks[0])  # a pool would only add the cost of starting a process
+    else:
+        blocks = dict()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_blocks in executor.map(_load_chunk_blocks, chunks):
+                blocks.update(chunk_blocks)
+    block_store = _load_block_store(location)
+    if block_store is not None:
+        blocks = {block_id: block_store[block_id] if block is None else block for block_id, block in blocks.items()}
+    return {block_id: block for block_id, block in blocks.items() if block.created_at != 0}
+
+
+def rep_metrics(location: str, sim_seconds: float, percents: Sequence[float] = (0.5, 0.9)) -> dict:
+    """
+    Loads a repetition and computes its summary metrics: number of blocks, stale rate, average block interval (in iterations,
+    averaged over nodes), transactions per second and mean percentile delays (in iterations).
+    * location (str): Directory of the repetition (`{results_dir}/{sim_name}_{rep}`).
+    * sim_seconds (float): Total real-world seconds simulated (`sim_iters * iter_seconds`).
+    * percents (Sequence[float]): Shares of nodes to calculate mean delays for.
+    """
+    bookkeeper, nodes = load_rep(location)
+    an = Analysis(bookkeeper, nodes)
+    blocks = an.get_all_blocks()
+    metrics = {
+        'blocks': len(blocks),
+        'stale_rate': an.stale_block_rate(None) if blocks else 0.0,
+        'block_interval': float(np.mean([an.avg_block_interval(node) for node in nodes])),
+        'tps': an.transactions_per_second(list(blocks.values()), sim_seconds),
+    }
+    for percent, curve in an.percentile_delays(percents).items():
+        metrics[f'delay_{round(percent * 100)}'] = float(np.nanmean(curve)) if np.any(~np.isnan(curve)) else None
+    return metrics
+
+
+def metrics_table(results_dir: str, sim_name: str, sim_seconds: float, percents: Sequence[float] = (0.5, 0.9),
+                  workers: int = None) -> List[dict]:
+    """
+    Computes `rep_metrics` for every complete repetition of a simulation in parallel, one repetition per process.
+    Returns one row per repetition, ordered by repetition, with the repetition index under `rep`.
+    * results_dir (str): Results directory of the simulation.
+    * sim_name (str): Name of the simulation.
+    * sim_seconds (float): Total real-world seconds simulated (`sim_iters * iter_seconds`).
+    * percents (Sequence[float]): Shares of nodes to calculate mean delays for.
+    * workers (int): Number of processes. Defaults to the number of CPUs.
+    """
+    pattern = re.compile(re.escape(sim_name) + r'_(\d+)')
+    reps = sorted(int(match.group(1)) for match in map(pattern.fullmatch, os.listdir(results_dir))
+                  if match is not None and os.path.exists(f'{results_dir}/{match.group(0)}/bookkeeper'))
+    locations = [f'{results_dir}/{sim_name}_{rep}' for rep in reps]
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), max(len(reps), 1))) as executor:
+        rows = list(executor.map(rep_metrics, locations, [sim_seconds] * len(reps), [percents] * len(reps)))
+    return [{'rep': rep, **row} for rep, row in zip(reps, rows)]
+
+
+_RESULT_FILES = {'bookkeeper', 'bookkeeper.tmp', 'blocks', 'events.bin'}
+
+
+def _node_files(location: str) -> List[str]:
+    return sorted(filename for filename in os.listdir(location)
+                  if filename not in _RESULT_FILES and os.path.isfile(f'{location}/{filename}'))
+
+
+def _load_block_store(location: str) -> BlockStore:
+    # dumps made before blocks were saved separately keep them in the node files
+    if not os.path.exists(f'{location}/blocks'):
+        return None
+    with open(f'{location}/blocks', 'rb') as f:
+        return pickle.load(f)
+
+
+def _load_chunk_blocks(paths: List[str]) -> Dict[int, Block]:
+    # blocks are None (i.e. only ids) in nodes saved with a block store
+    blocks = dict()
+    for path in paths:
+        with open(path, 'rb') as f:
+            node = pickle.load(f)
+        for block_id, block in node.blockchain.items():
+            if block != 'placeholder':
+                blocks[block_id] = block
+    return blocks
@@ -1,18 +1,25 @@
+import os
 import sys
 from typing import List, Dict
 
+import numpy as np
+
 sys.path.append('..')
 
 from sim.base_models import *
 
+EVENT_BLOCK, EVENT_TX = 0, 1
+EVENT_DTYPE = np.dtype([('kind', np.uint8), ('node', np.int64), ('item', np.int64), ('time', np.int64)])
+"""Record layout of the event log written by `StreamingBookkeeper`."""
+
 
 class Bookkeeper:
     def __init__(self):
         self.num_tx_in_pool: List[int] = []
-        self.node_block_rcvs: Dict[str, Dict[str, int]] = dict()
-        self.node_tx_rcvs: Dict[str, Dict[str, int]] = dict()
-        self.node_compute: Dict[str, List[int]] = dict()
-        self.node_space: Dict[str, List[int]] = dict()
+        self.node_block_rcvs: Dict[int, Dict[int, int]] = dict()
+        self.node_tx_rcvs: Dict[int, Dict[int, int]] = dict()
+        self.node_compute: Dict[int, List[int]] = dict()
+        self.node_space: Dict[int, List[int]] = dict()
 
     def register_node(self, node: Node):
         """
@@ -42,6 +49,12 @@ class Bookkeeper:
         """
         return self.node_block_rcvs[node.id].get(block.id, 2**64)
 
+    def get_node_block_rcvs(self, node: Node) -> Dict[int, int]:
+        """
+        Get receipt times of all blocks received by given node as a dictionary with block ids as keys.
+        """
+        return self.node_block_rcvs.get(node.id, dict())
+
     def use_compute(self, node: Node, amount: int):
         """
         Record computational power usage (simulated)  by node.
@@ -54,3 +67,230 @@ class Bookkeeper:
         """
         self.node_space[node.id].append(amount)
 
+
+class ArrayBookkeeper(Bookkeeper):
+    """
+    Bookkeeper that stores block receipt times in a dense matrix instead of nested dictionaries.
+
+    Nodes and blocks are assigned row and column indices in the order they are first seen. The matrix grows by doubling and
+    uses `MISSING` for blocks a node has not received, so the receipt times of a block across all nodes are a single row slice.
+    Transaction receipts are kept as in `Bookkeeper`.
+    """
+    MISSING = np.iinfo(np.int64).max
+
+    def __init__(self):
+        super().__init__()
+        self.node_indices: Dict[int, int] = dict()
+        self.block_indices: Dict[int, int] = dict()
+        self.block_rcvs = np.full((16, 16), ArrayBookkeeper.MISSING, dtype=np.int64)
+        """Receipt times with block indices as rows and node indices as columns."""
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['block_rcvs'] = self.block_rcvs[:len(self.block_indices), :len(self.node_indices)].copy()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def register_node(self, node: Node):
+        super().register_node(node)
+        idx = self.node_indices.setdefault(node.id, len(self.node_indices))
+        self._reserve(len(self.block_indices), len(self.node_indices))
+        self.block_rcvs[:, idx] = ArrayBookkeeper.MISSING
+
+    def save_block(self, node: Node, block: Item, timestamp: int):
+        row = self.block_indices.get(block.id, None)
+        if row is None:
+            row = self.block_indices[block.id] = len(self.block_indices)
+            self._reserve(len(self.block_indices), len(self.node_indices))
+        self.block_rcvs[row, self.node_indices[node.id]] = timestamp
+
+    def get_node_block_rcv(self, node: Node, block: Item) -> int:
+        row = self.block_indices.get(block.id, None)
+        if row is None:
+            return 2**64
+        timestamp = int(self.block_rcvs[row, self.node_indices[node.id]])
+        return 2**64 if timestamp == ArrayBookkeeper.MISSING else timestamp
+
+    def get_node_block_rcvs(self, node: Node) -> Dict[int, int]:
+        column = self.block_rcvs[:len(self.block_indices), self.node_indices[node.id]]
+        return {block_id: int(column[row]) for block_id, row in self.block_indices.items()
+                if column[row] != ArrayBookkeeper.MISSING}
+
+    def get_block_rcvs(self, block: Item, nodes: List[Node] = None) -> np.ndarray:
+        """
+        Returns the receipt times of the given block for the given nodes (all registered nodes by default, in registration order).
+        Nodes that did not receive the block have the value `MISSING`.
+        """
+        row = self.block_indices.get(block.id, None)
+        columns = self.node_columns(nodes)
+        if row is None:
+            return np.full(len(columns), ArrayBookkeeper.MISSING, dtype=np.int64)
+        return self.block_rcvs[row, columns]
+
+    def get_rcv_matrix(self, blocks: List[Item], nodes: List[Node] = None) -> np.ndarray:
+        """
+        Returns the receipt times of the given blocks (rows) for the given nodes (columns) as a matrix.
+        Nodes that did not receive a block have the value `MISSING`.
+        """
+        rows = [self.block_indices.get(block.id, -1) for block in blocks]
+        columns = self.node_columns(nodes)
+        matrix = self.block_rcvs[np.ix_(rows, columns)] if rows else np.zeros((0, len(columns)), dtype=np.int64)
+        matrix[[idx for idx, row in enumerate(rows) if row == -1]] = ArrayBookkeeper.MISSING
+        return matrix
+
+    def node_columns(self, nodes: List[Node] = None) -> np.ndarray:
+        """
+        Returns the column indices of the given nodes (all registered nodes by default).
+        """
+        if nodes is None:
+            return np.arange(len(self.node_indices))
+        return np.array([self.node_indices[node.id] for node in nodes], dtype=np.int64)
+
+    def _reserve(self, rows: int, columns: int):
+        capacity_rows, capacity_columns = self.block_rcvs.shape
+        if rows <= capacity_rows and columns <= capacity_columns:
+            return
+        capacity_rows, capacity_columns = max(capacity_rows, 1), max(capacity_columns, 1)
+        while capacity_rows < rows:
+            capacity_rows *= 2
+        while capacity_columns < columns:
+            capacity_columns *= 2
+        grown = np.full((capacity_rows, capacity_columns), ArrayBookkeeper.MISSING, dtype=np.int64)
+        grown[:self.block_rcvs.shape[0], :self.block_rcvs.shape[1]] = self.block_rcvs
+        self.block_rcvs = grown
+
+
+class StreamingBookkeeper(Bookkeeper):
+    """
+    Bookkeeper that streams block and transaction receipts to a binary event log instead of keeping them in memory.
+
+    Events are buffered and appended to the log in batches as `EVENT_DTYPE` records. Only per-node receipt counts are kept in memory,
+    so memory use does not grow with the simulation length. Use `load` to read a log back into a regular `Bookkeeper`.
+    Receipt queries (e.g. `get_node_block_rcv`) read the log back the same way.
+    """
+
+    def __init__(self, batch_size: int = 65536):
+        """
+        * batch_size (int): Number of events to buffer before writing them to the log.
+        """
+        super().__init__()
+        self.batch_size = batch_size
+        self.path: str = None
+        self.file = None
+        self.buffer = []
+        self.block_rcv_counts: Dict[int, int] = dict()
+        self.tx_rcv_counts: Dict[int, int] = dict()
+        self.loaded: Bookkeeper = None  # receipts read back from the log by `receipts`
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['file']
+        del state['buffer']
+        del state['loaded']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.file = None
+        self.buffer = []
+        self.loaded = None
+
+    def open(self, path: str, keep: int = 0):
+        """
+        Start a new event log at the given path, closing the current one.
+        * keep (int): Number of bytes at the start of an existing log to keep and append to, e.g. when resuming from a checkpoint.
+        """
+        self.close()
+        self.path = path
+        self.file = open(path, 'r+b' if keep > 0 else 'wb')
+        self.file.truncate(keep)
+        self.file.seek(keep)
+
+    def tell(self) -> int:
+        """
+        Write the buffered events and return the size of the event log in bytes.
+        """
+        self.flush()
+        return self.file.tell()
+
+    def close(self):
+        """
+        Write the buffered events and close the event log.
+        """
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def flush(self):
+        """
+        Write the buffered events to the event log.
+        """
+        if self.buffer:
+            np.array(self.buffer, dtype=EVENT_DTYPE).tofile(self.file)
+            self.buffer = []
+
+    def register_node(self, node: Node):
+        super().register_node(node)
+        self.block_rcv_counts[node.id] = 0
+        self.tx_rcv_counts[node.id] = 0
+
+    def save_block(self, node: Node, block: Item, timestamp: int):
+        self.block_rcv_counts[node.id] += 1
+        self.loaded = None
+        self.buffer.append((EVENT_BLOCK, node.id, block.id, timestamp))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def save_tx(self, node: Node, tx: Item, timestamp: int):
+        self.tx_rcv_counts[node.id] += 1
+        self.buffer.append((EVENT_TX, node.id, tx.id, timestamp))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def get_node_block_rcv(self, node: Node, block: Item) -> int:
+        return self.receipts().get_node_block_rcv(node, block)
+
+    def get_node_block_rcvs(self, node: Node) -> Dict[int, int]:
+        return self.receipts().get_node_block_rcvs(node)
+
+    def receipts(self) -> Bookkeeper:
+        """
+        Returns the block receipts in the event log as a regular `Bookkeeper` (see `load`). The result is cached until a new block receipt is saved.
+        """
+        if self.loaded is None:
+            if self.file is not None:
+                self.flush()
+                self.file.flush()
+            self.loaded = StreamingBookkeeper.load(self.path)
+            for node_id in self.block_rcv_counts:
+                self.loaded.node_block_rcvs.setdefault(node_id, dict())
+        return self.loaded
+
+    @staticmethod
+    def read_events(path: str) -> np.ndarray:
+        """
+        Returns the records of an event log as a memory-mapped structured array.
+        """
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=EVENT_DTYPE)
+        return np.memmap(path, dtype=EVENT_DTYPE, mode='r')
+
+    @staticmethod
+    def load(path: str, include_txs: bool = False) -> Bookkeeper:
+        """
+        Read an event log into a regular `Bookkeeper`.
+        * path (str): Path of the event log.
+        * include_txs (bool): Also load transaction receipts. These can be much larger than block receipts.
+        """
+        bookkeeper = Bookkeeper()
+        events = StreamingBookkeeper.read_events(path)
+        kinds = [EVENT_BLOCK, EVENT_TX] if include_txs else [EVENT_BLOCK]
+        for kind in kinds:
+            rcvs = bookkeeper.node_block_rcvs if kind == EVENT_BLOCK else bookkeeper.node_tx_rcvs
+            selected = events[events['kind'] == kind]
+            for node_id, item_id, time in zip(selected['node'].tolist(), selected['item'].tolist(), selected['time'].tolist()):
+                rcvs.setdefault(node_id, dict())[item_id] = time
+        return bookkeeper
@@ -0,0 +1,167 @@
+"""
+Columnar export of simulation results.
+
+Instead of pickling every node, `save_columnar` writes each block and transaction once, plus the receipt times of every node,
+as flat NumPy arrays under `<path>/columnar`. `ColumnarResults` opens them memory-mapped, so arbitrarily large result sets can be
+analyzed without loading them into memory.
+
+Layout (one `.npy` file per column):
+* `blocks/`: `id`, `prev_id`, `height`, `created_at`, `miner` (index into `miners` in `meta.json`), `size`, `tx_count`, `reward`, `fees`,
+  and `tx_offsets`/`tx_ids` listing the transaction ids of block `i` as `tx_ids[tx_offsets[i]:tx_offsets[i + 1]]`. Rows are sorted by id.
+* `txs/`: `id`, `size`, `fee`, `value`, `created_at` of the transactions included in blocks. Rows are sorted by id.
+* `block_rcvs/`: `block` (row in `blocks`) and `time` of each block receipt, grouped by node. The receipts of node `i` are the rows `offsets[i]:offsets[i + 1]`.
+* `tx_rcvs/`: `tx` (transaction id) and `time` of each transaction receipt, grouped by node in the same way.
+* `meta.json`: node names, ids, regions, mining powers and heads, and the list of miner names. Written last; its presence marks a complete export.
+"""
+
+import os
+import json
+import shutil
+from pathlib import Path
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+from bitcoin.models import Miner, Block, Transaction
+from bitcoin.bookkeeper import Bookkeeper
+
+
+def save_columnar(path: str, nodes: List[Miner], bookkeeper: Bookkeeper):
+    """
+    Export the results of a simulation run to `<path>/columnar`, replacing any previous export.
+    * path (str): Directory of the simulation run.
+    * nodes (List[Miner]): Nodes of the simulation.
+    * bookkeeper (Bookkeeper): Bookkeeper of the simulation.
+    """
+    target = Path(path) / 'columnar'
+    tmp = Path(path) / 'columnar.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    for table in ['blocks', 'txs', 'block_rcvs', 'tx_rcvs']:
+        (tmp / table).mkdir(parents=True)
+
+    blocks: Dict[int, Block] = dict()
+    for node in nodes:
+        for block in list(node.blockchain.values()) + getattr(node, 'withheld', []):
+            if isinstance(block, Block):
+                blocks[block.id] = block
+    blocks_sorted = [blocks[block_id] for block_id in sorted(blocks)]
+    block_rows = {block.id: row for row, block in enumerate(blocks_sorted)}
+
+    miners = sorted({block.miner for block in blocks_sorted})
+    miner_indices = {name: idx for idx, name in enumerate(miners)}
+    txs: Dict[int, Transaction] = dict()
+    tx_counts = []
+    for block in blocks_sorted:
+        tx_counts.append(len(block.transactions))
+        for tx in block.transactions:
+            txs[tx.id] = tx
+
+    _save(tmp / 'blocks', 'id', [block.id for block in blocks_sorted], np.int64)
+    _save(tmp / 'blocks', 'prev_id', [block.prev_id if block.prev_id is not None else -1 for block in blocks_sorted], np.int64)
+    _save(tmp / 'blocks', 'height', [block.height for block in blocks_sorted], np.int64)
+    _save(tmp / 'blocks', 'created_at', [block.created_at for block in blocks_sorted], np.int64)
+    _save(tmp / 'blocks', 'miner', [miner_indices[block.miner] for block in blocks_sorted], np.int32)
+    _save(tmp / 'blocks', 'size', [getattr(block, 'size', 0) for block in blocks_sorted], np.float64)
+    _save(tmp / 'blocks', 'tx_count', [block.tx_count for block in blocks_sorted], np.float64)
+    _save(tmp / 'blocks', 'reward', [block.reward.value if block.reward is not None else 0 for block in blocks_sorted],
+          np.float64)
+    _save(tmp / 'blocks', 'fees', [getattr(block, 'fees', 0) for block in blocks_sorted], np.float64)
+    _save(tmp / 'blocks', 'tx_offsets', np.concatenate([[0], np.cumsum(tx_counts, dtype=np.int64)]), np.int64)
+    _save(tmp / 'blocks', 'tx_ids', [tx.id for block in blocks_sorted for tx in block.transactions], np.int64)
+
+    txs_sorted = [txs[tx_id] for tx_id in sorted(txs)]
+    _save(tmp / 'txs', 'id', [tx.id for tx in txs_sorted], np.int64)
+    _save(tmp / 'txs', 'size', [tx.size for tx in txs_sorted], np.float64)
+    _save(tmp / 'txs', 'fee', [tx.fee for tx in txs_sorted], np.float64)
+    _save(tmp / 'txs', 'value', [tx.value for tx in txs_sorted], np.float64)
+    _save(tmp / 'txs', 'created_at', [tx.created_at for tx in txs_sorted], np.int64)
+
+    block_rcvs = [[(block_rows[block_id], time) for block_id, time in bookkeeper.get_node_block_rcvs(node).items()
+                   if block_id in block_rows] for node in nodes]
+    _save_rcvs(tmp / 'block_rcvs', 'block', block_rcvs)
+    tx_rcvs = [list(bookkeeper.node_tx_rcvs.get(node.id, dict()).items()) for node in nodes]
+    _save_rcvs(tmp / 'tx_rcvs', 'tx', tx_rcvs)
+
+    meta = {
+        'nodes': [{
+            'id': node.id,
+            'name': node.name,
+            'region': node.region.value if node.region is not None else None,
+            'mine_power': node.mine_power,
+            'head': node.head.id if node.head is not None else None,
+        } for node in nodes],
+        'miners': miners,
+    }
+    with open(tmp / 'meta.json', 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+
+
+def _save(directory: Path, name: str, values, dtype):
+    np.save(directory / f'{name}.npy', np.asarray(values, dtype=dtype))
+
+
+def _save_rcvs(directory: Path, key: str, rcvs: List[List[Tuple[int, int]]]):
+    _save(directory, 'offsets', np.concatenate([[0], np.cumsum([len(node_rcvs) for node_rcvs in rcvs], dtype=np.int64)]),
+          np.int64)
+    _save(directory, key, [item for node_rcvs in rcvs for item, _ in node_rcvs], np.int64)
+    _save(directory, 'time', [time for node_rcvs in rcvs for _, time in node_rcvs], np.int64)
+
+
+class ColumnarResults:
+    """Read-only view of results exported with `save_columnar`. Columns are memory-mapped on first access."""
+
+    def __init__(self, path: str):
+        """
+        Open an export.
+        * path (str): Directory of the simulation run (containing the `columnar` directory).
+        """
+        self.path = Path(path) / 'columnar'
+        with open(self.path / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+        self.nodes: List[dict] = self.meta['nodes']
+        self.miners: List[str] = self.meta['miners']
+        self.columns: Dict[Tuple[str, str], np.ndarray] = dict()
+
+    def column(self, table: str, name: str) -> np.ndarray:
+        """
+        Returns a column as a memory-mapped array.
+        * table (str): Table name (e.g. 'blocks').
+        * name (str): Column name (e.g. 'created_at').
+        """
+        key = (table, name)
+        if key not in self.columns:
+            self.columns[key] = np.load(self.path / table / f'{name}.npy', mmap_mode='r')
+        return self.columns[key]
+
+    def block_rows(self, block_ids) -> np.ndarray:
+        """
+        Returns the rows of the given block ids in the `blocks` table.
+        """
+        return np.searchsorted(self.column('blocks', 'id'), block_ids)
+
+    def block_txs(self, row: int) -> np.ndarray:
+        """
+        Returns the ids of the transactions in the block at the given row.
+        """
+        offsets = self.column('blocks', 'tx_offsets')
+        return self.column('blocks', 'tx_ids')[offsets[row]:offsets[row + 1]]
+
+    def node_block_rcvs(self, node_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the block rows and receipt times of all blocks received by the node at the given index.
+        """
+        return self._node_rcvs('block_rcvs', 'block', node_idx)
+
+    def node_tx_rcvs(self, node_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the ids and receipt times of all transactions received by the node at the given index.
+        """
+        return self._node_rcvs('tx_rcvs', 'tx', node_idx)
+
+    def _node_rcvs(self, table: str, key: str, node_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        offsets = self.column(table, 'offsets')
+        start, end = offsets[node_idx], offsets[node_idx + 1]
+        return self.column(table, key)[start:end], self.column(table, 'time')[start:end]
@@ -1,6 +1,9 @@
 from sim.base_models import Node, Item, Reward
-from typing import List
+from typing import List, Dict, Set
 import random
+import math
+
+import numpy as np
 
 
 class Oracle:
@@ -15,6 +18,12 @@ class Oracle:
         """
         pass
 
+    def next_block_time(self, miner: Node) -> int:
+        """
+        Returns the step at which the given miner will next be allowed to mine, or None if that is not known in advance.
+        """
+        return None
+
     def get_reward(self, miner: Node) -> Reward:
         """
         Returns mining reward.
@@ -23,19 +32,39 @@ class Oracle:
 
 
 class PoWOracle(Oracle):
-    def __init__(self, nodes: List[Node], block_interval: int, block_reward: int, dynamic=False):
+    def __init__(self, nodes: List[Node], block_interval: int, block_reward: int, dynamic=False, scheduled=False):
+        """
+        * scheduled (bool): If True, each miner's next block time is drawn in advance instead of rolling a die at every step. Required for event-driven simulations.
+
+        With `dynamic` and `scheduled` both set, the block times are redrawn whenever a miner's power changes.
+        """
         super().__init__(nodes, block_interval)
         self.dynamic = dynamic
+        self.scheduled = scheduled
         self.total_power = self.compute_total_power()
         self.block_reward = block_reward
 
         self.timestamp = 0
-        self.new_total_mine_power = 0
+        self.new_total_mine_power = self.total_power
+        self.next_block_times: Dict[int, int] = dict()
+        self.mine_powers: Dict[int, float] = dict()  # powers the scheduled block times were drawn with
 
     def can_mine(self, miner: Node, *blocks) -> bool:
         """
         A miner is allowed to mine each block with a certain probability computed with respect to that miner's power, total power, and the expected block interval.
         """
+        if self.scheduled and len(blocks) <= 1:
+            if self.dynamic and miner.mine_power != self.mine_powers.get(miner.id, miner.mine_power):
+                self.update_power(miner.timestamp, miner)
+            if miner.id not in self.next_block_times:
+                # drawn before the current step, as when an event-driven simulation asks for it between steps
+                self.schedule_block(miner, miner.timestamp - 1)
+            block_time = self.next_block_time(miner)
+            if block_time is None or miner.timestamp < block_time:
+                return False
+            self.schedule_block(miner, miner.timestamp)
+            return True
+
         if self.dynamic:
             if miner.timestamp > self.timestamp:
                 self.total_power = self.new_total_mine_power
@@ -49,6 +78,52 @@ class PoWOracle(Oracle):
             return [random.random() <= (miner.mine_power / len(blocks)) / (self.block_interval * self.total_power)
                     for _ in blocks]
 
+    def next_block_time(self, miner: Node) -> int:
+        """
+        Returns the step at which the given miner will next find a block. Only available if the oracle is `scheduled`.
+        """
+        if not self.scheduled:
+            return None
+        if miner.id not in self.next_block_times:
+            self.schedule_block(miner, miner.timestamp)
+        return self.next_block_times[miner.id]
+
+    def schedule_block(self, miner: Node, timestamp: int):
+        """
+        Draws and stores the miner's next block time after the given step.
+        """
+        self.next_block_times[miner.id] = self.draw_block_time(miner, timestamp)
+        self.mine_powers[miner.id] = miner.mine_power
+
+    def update_power(self, timestamp: int, miner: Node = None):
+        """
+        Recomputes the total mining power and redraws the block times of all scheduled miners from the given step on.
+        Since the time until the next block is memoryless, redrawing is equivalent to having used the new powers all along.
+        * timestamp (int): Current step.
+        * miner (Node): Miner being stepped. Its block time is redrawn from the step before, so that it can still mine in the current step.
+        """
+        self.total_power = self.compute_total_power()
+        for node in self.nodes:
+            if node is miner:
+                self.schedule_block(node, timestamp - 1)
+            elif node.id in self.next_block_times:
+                self.schedule_block(node, timestamp)
+                if node.scheduler is not None:
+                    node.scheduler.wake(node, self.next_block_times[node.id])
+
+    def draw_block_time(self, miner: Node, timestamp: int) -> int:
+        """
+        Draws the step of the miner's first success after the given step.
+        The number of steps until a success follows the geometric distribution with the same per-step success probability as `can_mine`.
+        Returns None if the miner has no mining power.
+        """
+        prob = miner.mine_power / (self.block_interval * self.total_power)
+        if prob <= 0:
+            return None
+        if prob >= 1:
+            return timestamp + 1
+        return timestamp + 1 + int(math.log(1 - random.random()) / math.log(1 - prob))
+
     def compute_total_power(self) -> float:
         """
         Returns the total mining power, iterating over all nodes.
@@ -62,3 +137,54 @@ class PoWOracle(Oracle):
         return Reward(miner, self.block_reward)
 
 
+
+
+class BatchedPoWOracle(PoWOracle):
+    """
+    PoW oracle that runs the mining lottery of all miners for a chunk of steps at once.
+
+    The number of blocks each miner finds in a chunk is drawn from the binomial distribution with one vectorized call,
+    and the winning steps are then spread uniformly over the chunk. This has the same distribution as the per-step draws of `PoWOracle`,
+    while `can_mine` reduces to a lookup.
+    """
+    def __init__(self, nodes: List[Node], block_interval: int, block_reward: int, dynamic=False, chunk_steps: int = None):
+        """
+        * chunk_steps (int): Number of steps to run the lottery for at once. Defaults to the block interval.
+
+        With `dynamic` set, mining powers are reread from the nodes at the start of each chunk.
+        """
+        super().__init__(nodes, block_interval, block_reward, dynamic=dynamic)
+        self.chunk_steps = chunk_steps if chunk_steps is not None else block_interval
+        self.indices: Dict[int, int] = {node.id: idx for idx, node in enumerate(nodes)}
+        self.powers = np.array([node.mine_power for node in nodes], dtype=float)
+        self.rng = np.random.default_rng(random.getrandbits(64))
+
+        self.chunk_start, self.chunk_end = 0, 0
+        self.winners: Dict[int, Set[int]] = dict()
+        """Dictionary with steps as keys and sets of indices of the miners that find a block at that step as values."""
+
+    def can_mine(self, miner: Node, *blocks) -> bool:
+        """
+        Returns True if the miner won the lottery for its current step. Multiple blocks are handled as in `PoWOracle`.
+        """
+        if len(blocks) > 1:
+            return super().can_mine(miner, *blocks)
+        if not self.chunk_start <= miner.timestamp < self.chunk_end:
+            self.draw_chunk(miner.timestamp)
+        return self.indices.get(miner.id, -1) in self.winners.get(miner.timestamp, ())
+
+    def draw_chunk(self, start: int):
+        """
+        Runs the lottery of all miners for the `chunk_steps` steps beginning with the given step.
+        """
+        if self.dynamic:
+            self.powers = np.fromiter((node.mine_power for node in self.nodes), dtype=float, count=len(self.nodes))
+            self.total_power = self.powers.sum()
+        probs = np.clip(self.powers / (self.block_interval * self.total_power), 0, 1)
+        counts = self.rng.binomial(self.chunk_steps, probs)
+
+        self.winners = dict()
+        for idx in np.flatnonzero(counts):
+            for offset in self.rng.choice(self.chunk_steps, size=counts[idx], replace=False):
+                self.winners.setdefault(start + int(offset), set()).add(int(idx))
+        self.chunk_start, self.chunk_end = start, start + self.chunk_steps
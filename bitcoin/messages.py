@@ -6,16 +6,24 @@ import sys
 
 sys.path.append("..")
 
+from typing import List
+
 from sim.base_models import *
 
 
 class InvMessage(Item):
-    """Represents INV messages used to announce new blocks."""
-    def __init__(self, item_id: str, type: str, sender_id: str):
+    """
+    Represents INV messages used to announce new blocks.
+
+    A single message is shared by all the peers it is sent to, so it must not be modified after it is sent.
+    """
+    __slots__ = ('item_id', 'type')
+
+    def __init__(self, item_id: int, type: str, sender_id: int):
         """
         Create an InvMessage object.
-        * item_id (str): Id of the block/transaction being announced.
-        * sender_id (str): Id of the sender node. Can be used as a return address.
+        * item_id (int): Id of the block/transaction being announced.
+        * sender_id (int): Id of the sender node. Can be used as a return address.
         * size (float): size of the item in bytes.
         """
         super().__init__(sender_id, 100)
@@ -26,14 +34,100 @@ class InvMessage(Item):
 
 class GetDataMessage(Item):
     """Represents GET_DATA messages used to request blocks after receiving INV messages."""
-    def __init__(self, item_id: str, type: str, sender_id: str):
+    __slots__ = ('item_id', 'type')
+
+    def __init__(self, item_id: int, type: str, sender_id: int):
         """
         Create a GetDataMessage object.
-        * item_id (str): Id of the block/transaction being requested.
-        * sender_id (str): Id of the sender node. Can be used as a return address.
+        * item_id (int): Id of the block/transaction being requested.
+        * sender_id (int): Id of the sender node. Can be used as a return address.
         * size (float): size of the item in bytes.
         """
         super().__init__(sender_id, 100)
         self.size = 100
         self.item_id = item_id
         self.type = type
+
+
+class InvBatchMessage(Item):
+    """
+    Represents INV messages announcing several items at once (see `bitcoin.tx_modelings.FullTxModel`).
+
+    A single message is shared by all the peers it is sent to, so it must not be modified after it is sent.
+    """
+    __slots__ = ('item_ids', 'type')
+
+    def __init__(self, item_ids: List[int], type: str, sender_id: int):
+        """
+        Create an InvBatchMessage object.
+        * item_ids (List[int]): Ids of the blocks/transactions being announced.
+        * sender_id (int): Id of the sender node. Can be used as a return address.
+        """
+        super().__init__(sender_id, 100 + 36 * (len(item_ids) - 1))
+        self.item_ids = item_ids
+        self.type = type
+
+
+class GetDataBatchMessage(Item):
+    """Represents GET_DATA messages used to request several items at once after receiving `InvBatchMessage`s."""
+    __slots__ = ('item_ids', 'type')
+
+    def __init__(self, item_ids: List[int], type: str, sender_id: int):
+        """
+        Create a GetDataBatchMessage object.
+        * item_ids (List[int]): Ids of the blocks/transactions being requested.
+        * sender_id (int): Id of the sender node. Can be used as a return address.
+        """
+        super().__init__(sender_id, 100 + 36 * (len(item_ids) - 1))
+        self.item_ids = item_ids
+        self.type = type
+
+
+class CompactBlockMessage(Item):
+    """
+    Represents BIP152 compact blocks: the block header and a 6-byte short id per transaction, sent instead of the full block.
+    The receiver rebuilds the block from the transactions it already has (see `bitcoin.models.Miner.consume`).
+    """
+    __slots__ = ('block',)
+
+    def __init__(self, block: Block, sender_id: int):
+        """
+        Create a CompactBlockMessage object.
+        * block (Block): Block being relayed. Only its header and short ids are charged for.
+        * sender_id (int): Id of the sender node. Can be used as a return address.
+        """
+        super().__init__(sender_id, 88 + 6 * int(block.tx_count))
+        self.block = block
+
+
+class GetBlockTxnMessage(Item):
+    """Represents BIP152 GETBLOCKTXN messages used to request the transactions of a compact block the receiver does not have."""
+    __slots__ = ('block_id', 'tx_ids')
+
+    def __init__(self, block_id: int, tx_ids: List[int], sender_id: int):
+        """
+        Create a GetBlockTxnMessage object.
+        * block_id (int): Id of the compact block.
+        * tx_ids (List[int]): Ids of the missing transactions.
+        * sender_id (int): Id of the sender node. Can be used as a return address.
+        """
+        super().__init__(sender_id, 100 + 6 * len(tx_ids))
+        self.block_id = block_id
+        self.tx_ids = tx_ids
+
+
+class BlockTxnMessage(Item):
+    """Represents BIP152 BLOCKTXN messages carrying the missing transactions of a compact block."""
+    __slots__ = ('block', 'tx_ids')
+
+    def __init__(self, block: Block, tx_ids: List[int], size: float, sender_id: int):
+        """
+        Create a BlockTxnMessage object.
+        * block (Block): The compact block.
+        * tx_ids (List[int]): Ids of the transactions sent.
+        * size (float): Total size of the transactions sent in bytes.
+        * sender_id (int): Id of the sender node. Can be used as a return address.
+        """
+        super().__init__(sender_id, 100 + size)
+        self.block = block
+        self.tx_ids = tx_ids
@@ -2,7 +2,7 @@
 Mining strategies. For performance, although not strictly enforced, we recommend using these classes as singletons.
 """
 
-from loguru import logger
+from sim import log
 
 from bitcoin.models import Miner, BTCBlock
 from bitcoin.consensus import Reward
@@ -22,12 +22,7 @@ class NullMining:
         """
         Returns the head of the longest chain.
         """
-        max_height, max_block = 0, None
-        for block in node.blockchain.values():
-            if type(block) != str and block.height >= max_height:
-                max_block = block
-                max_height = block.height
-        return max_block
+        return node.head
 
     def generate_block(self, node: Miner, prev: BTCBlock = None) -> BTCBlock:
         """
@@ -41,7 +36,7 @@ class NullMining:
 
         The given block is published to the node's peers if `relay` is True.
         """
-        node.blockchain[block.id] = block
+        node.add_block(block)
         node.bookkeeper.save_block(node, block, node.timestamp)
         node.tx_model.update_mempool(node, block)
         if relay:
@@ -66,7 +61,7 @@ class HonestMining(NullMining):
         block = node.tx_model.fill_block(node, block)
         block.reward = node.consensus_oracle.get_reward(node)
         self.receive_block(node, block, relay=True)
-        logger.success(f'[{node.timestamp}] {node.name} GENERATED BLOCK {block.id} ==> {prev.id}')
+        log.success('[{}] {} GENERATED BLOCK {} ==> {}', node.timestamp, node.name, block.id, prev.id)
         return block
 
     def receive_block(self, node: Miner, block: BTCBlock, relay: bool = False, shallow=False):
@@ -82,29 +77,23 @@ class SelfishMining(NullMining):
         super().__init__()
 
     def setup(self, node: Miner):
-        node.private_chain = node.blockchain.copy()
-        node.private_branch_len = 0
+        self.reset_private_chain(node)
 
     def choose_head(self, node: Miner, private=True) -> BTCBlock:
-        chain = node.private_chain if private else node.blockchain
-
-        max_height, max_block = 0, None
-        for block in chain.values():
-            if type(block) != str and block.height >= max_height:
-                max_block = block
-                max_height = block.height
-        return max_block
+        return node.private_head if private else node.head
 
     def generate_block(self, node: Miner, prev: BTCBlock = None) -> BTCBlock:
         if prev is None:
             prev = self.choose_head(node)
         block = BTCBlock(node, prev.id, prev.height + 1)
-        block.id = '[SELFISH]' + block.id
         block = node.tx_model.fill_block(node, block)
         block.reward = node.consensus_oracle.get_reward(node)
-        logger.success(f'[{node.timestamp}] {node.name} GENERATED BLOCK {block.id} ==> {prev.id}')
+        log.success('[{}] {} GENERATED BLOCK {} ==> {}', node.timestamp, node.name, block.id, prev.id)
 
-        node.private_chain[block.id] = block
+        node.block_store.add(block)
+        node.withheld.append(block)
+        if node.private_head is None or block.height >= node.private_head.height:
+            node.private_head = block
         node.bookkeeper.save_block(node, block, node.timestamp)
         node.tx_model.update_mempool(node, block)
 
@@ -123,17 +112,30 @@ class SelfishMining(NullMining):
 
         if not shallow:
             if delta_prev == 0:
-                node.private_chain = node.blockchain.copy()
-                node.private_branch_len = 0
+                self.reset_private_chain(node)
             elif delta_prev == 1:
                 self.publish_private_chain(node)
             else:
                 self.publish_private_chain(node)
 
+    def reset_private_chain(self, node: Miner):
+        """
+        Adopt the public chain: the private chain restarts from the public head, with no withheld blocks.
+
+        The private chain is the chain ending in the public head as of the last reset, followed by the blocks in `node.withheld`.
+        """
+        node.withheld = []
+        node.private_head = node.head
+        node.private_branch_len = 0
+
     def publish_private_chain(self, node: Miner):
-        for block in node.private_chain.values():
-            node.blockchain[block.id] = block
+        """
+        Add the withheld blocks to the public chain and announce them to the node's peers.
+        """
+        for block in node.withheld:
+            node.add_block(block)
             node.publish_item(block, 'block')
+        node.withheld = []
 
     def get_delta_prev(self, node: Miner) -> int:
         priv_length = self.choose_head(node).height
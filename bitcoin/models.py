@@ -3,27 +3,49 @@ Main implementation of the Bitcoin simulator.
 """
 
 import sys
+import math
+import heapq
 
-from typing import Dict
+import numpy as np
+
+from typing import Dict, List
 
 sys.path.append("..")
 
-from loguru import logger
+from sim import log, util
 
 from sim.base_models import *
-from bitcoin.messages import InvMessage, GetDataMessage
+from bitcoin.messages import InvMessage, GetDataMessage, InvBatchMessage, GetDataBatchMessage, CompactBlockMessage, \
+    GetBlockTxnMessage, BlockTxnMessage
 from bitcoin.consensus import *
 from bitcoin.bookkeeper import *
 
 
 class Transaction(Item):
-    def __init__(self, sender_id: str, created_at: int, size: float, value: float, fee: float):
+    __slots__ = ('fee', 'value', 'created_at', 'feerate')
+    SIZE = 400
+    """Size of every transaction in bytes."""
+
+    def __init__(self, sender_id: int, created_at: int, size: float, value: float, fee: float, feerate: float = None):
         super().__init__(sender_id, 0)
-        self.fee: Reward = None
-        self.size = 400  # bytes
+        self.fee = fee
+        self.size = Transaction.SIZE
         self.value = 100
         self.created_at = created_at
-        self.feerate = self.fee / self.size
+        self.feerate = feerate if feerate is not None else self.fee / self.size
+
+    @staticmethod
+    def batch(sender_ids, created_at, fees: np.ndarray) -> List['Transaction']:
+        """
+        Create one transaction per element of the given array of fees. Feerates are computed for the whole batch at once.
+        * sender_ids (int or np.ndarray): Id of the node creating the transactions, or the id of the creator of each transaction.
+        * created_at (int or np.ndarray): Creation step, or the creation step of each transaction.
+        * fees (np.ndarray): Fees of the transactions.
+        """
+        feerates = fees / Transaction.SIZE
+        sender_ids, created_at = (np.broadcast_to(array, fees.shape).tolist() for array in [sender_ids, created_at])
+        return [Transaction(sender_id, step, Transaction.SIZE, 100, fee, feerate)
+                for sender_id, step, fee, feerate in zip(sender_ids, created_at, fees.tolist(), feerates.tolist())]
 
     def __str__(self) -> str:
         return f'TX (id:{self.id}, value: {self.value}, feerate: {self.feerate})'
@@ -36,10 +58,97 @@ class Transaction(Item):
         return self.feerate >= other.feerate
 
 
+class Mempool:
+    """
+    Pool of pending transactions ordered by feerate.
+
+    Removed transactions are only dropped from the underlying heap once they reach its top (or when the heap is compacted),
+    so removal takes O(1) instead of a linear search and re-heapify. Total size and transaction count are tracked incrementally.
+    """
+
+    def __init__(self):
+        self.heap: List[Transaction] = []  # heapq, may contain removed transactions
+        self.txs: Dict[int, Transaction] = dict()
+        """Pending transactions with ids as keys."""
+        self.size = 0
+        """Total size of pending transactions in bytes."""
+
+    def __len__(self) -> int:
+        return len(self.txs)
+
+    def __contains__(self, tx: Transaction) -> bool:
+        return tx.id in self.txs
+
+    def push(self, tx: Transaction):
+        """
+        Add a transaction to the pool. Does nothing if it is already pending.
+        """
+        if tx.id in self.txs:
+            return
+        self.txs[tx.id] = tx
+        self.size += tx.size
+        heapq.heappush(self.heap, tx)
+
+    def push_many(self, txs: List[Transaction]):
+        """
+        Add several transactions at once, skipping the ones already pending. Batches that are large compared to the pool are merged
+        into the heap with a single heapify instead of one push per transaction.
+        """
+        new = []
+        for tx in txs:
+            if tx.id not in self.txs:
+                self.txs[tx.id] = tx
+                self.size += tx.size
+                new.append(tx)
+        if len(new) * math.log2(len(self.heap) + 2) > len(self.heap) + len(new):
+            self.heap.extend(new)
+            heapq.heapify(self.heap)
+        else:
+            for tx in new:
+                heapq.heappush(self.heap, tx)
+
+    def pop(self) -> Transaction:
+        """
+        Remove and return the pending transaction with the highest feerate. Raises IndexError if the pool is empty.
+        """
+        while True:
+            tx = heapq.heappop(self.heap)
+            if self.txs.get(tx.id, None) is tx:
+                del self.txs[tx.id]
+                self.size -= tx.size
+                return tx
+
+    def remove(self, tx: Transaction):
+        """
+        Remove a transaction from the pool if it is pending.
+        """
+        if self.txs.pop(tx.id, None) is None:
+            return
+        self.size -= tx.size
+        if len(self.heap) > 2 * len(self.txs) + 64:
+            self.compact()
+
+    def compact(self):
+        """
+        Drop removed transactions from the heap.
+        """
+        self.heap = list(self.txs.values())
+        heapq.heapify(self.heap)
+
+
 class BTCBlock(Block):
-    def __init__(self, creator, prev_id: str, height: int):
+    HEADER_SIZE = 80
+    """Size of the block header in bytes."""
+
+    def __init__(self, creator, prev_id: int, height: int):
         super().__init__(creator, prev_id, height)
-        self.size = 80  # size of block header in bytes
+        self.size = BTCBlock.HEADER_SIZE
+        self.fees = 0
+        """Total fees of the transactions in the block."""
+
+    def add_tx(self, tx):
+        super().add_tx(tx)
+        self.fees += tx.fee
 
 
 class Miner(Node):
@@ -59,31 +168,50 @@ class Miner(Node):
         self.mine_power = mine_power
         self.max_block_size = 1
         self.tx_per_iter = 0
+        self.compact_blocks = False
+        """Request blocks from peers as BIP152 compact blocks."""
 
         # --- MODULES ---
         self.tx_model = None
         self.mine_strategy = None
         self.consensus_oracle: Oracle = None
 
-        self.mempool: List[Transaction] = []  # heapq
-        self.tx_ids: Dict[str, Transaction] = dict()
+        self.mempool = Mempool()
+        self.tx_ids: Dict[int, Transaction] = dict()
+        self.inv_queue: List[int] = []
+        """Ids of the transactions waiting to be announced in a batch (see `bitcoin.tx_modelings.FullTxModel`)."""
+        self.inv_flush_at: int = None
 
         # --- BOOKKEEPING ---
         self.bookkeeper: Bookkeeper = None
 
-        logger.info(f'CREATED MINER {self.name}')
+        log.info('CREATED MINER {}', self.name)
 
     def __getstate__(self):
         state = super().__getstate__()
-        del state['mempool']
-        del state['bookkeeper']
+        # shared modules are saved once by the simulation, if at all; the oracle and the tx model reference all nodes
+        for key in ['mempool', 'bookkeeper', 'consensus_oracle', 'tx_model', 'tx_ids']:
+            state.pop(key, None)
+        # private chain of selfish miners (see `bitcoin.mining_strategies.SelfishMining`)
+        if 'withheld' in state:
+            state['withheld'] = [block.id for block in self.withheld]
+            state['private_head'] = self.private_head.id if isinstance(self.private_head, Block) else self.private_head
         return state
 
+    def attach_store(self, block_store: BlockStore):
+        super().attach_store(block_store)
+        if hasattr(self, 'withheld'):
+            self.withheld = [block_store[block_id] for block_id in self.withheld]
+            if self.private_head is not None and not isinstance(self.private_head, Block):
+                self.private_head = block_store[self.private_head]
+
     def reset(self):
         """Reset state back to simulation start."""
         super().reset()
-        self.mempool = []
+        self.mempool = Mempool()
         self.tx_ids = dict()
+        self.inv_queue = []
+        self.inv_flush_at = None
         self.bookkeeper.register_node(self)  # to reset stats
 
     def step(self, seconds: float):
@@ -94,48 +222,104 @@ class Miner(Node):
         # TODO
         # tx_count = math.ceil(random.gauss(self.tx_per_iter, self.tx_per_iter / 10))
         tx_count = self.tx_per_iter
-        for c in range(tx_count):
-            self.tx_model.generate(self)
+        if tx_count > 0 and self.tx_model.generates_tx:
+            self.tx_model.generate_batch(self, tx_count)
 
         if self.consensus_oracle.can_mine(self):
             self.mine_strategy.generate_block(self)
 
+        self.tx_model.flush(self)
+
         # TODO: performance
         # space_use = sum([block.size for block in self.blockchain.values() if block != 'placeholder'])
         # space_use += self.tx_model.get_mempool_size(self)
         # self.bookkeeper.use_space(self, space_use)
 
+    def next_action_time(self):
+        """
+        Returns the next step the miner generates a transaction, finds a block or announces a batch of transactions at.
+        Miners generating transactions in their steps act at every step (see `bitcoin.tx_modelings.TxModel.generates_tx`).
+        """
+        if self.tx_per_iter > 0 and self.tx_model.generates_tx:
+            return self.timestamp + 1
+        times = [t for t in [self.consensus_oracle.next_block_time(self), self.tx_model.next_action_time(self)] if t is not None]
+        return min(times) if times else None
+
     def consume(self, item: Item):
         """
         Given an Item, performs the necessary action based on its type.
         * item (`sim.base_models.Item`): Item to consume.
         """
         if type(item) == BTCBlock:
-            logger.info(f'[{self.timestamp}] {self.name} RECEIVED BLOCK {item.id}')
+            log.info('[{}] {} RECEIVED BLOCK {}', self.timestamp, self.name, item.id)
             self.mine_strategy.receive_block(self, item, relay=True)
         elif type(item) == Transaction:
             self.tx_model.receive(self, item)
         elif type(item) == InvMessage:
-            logger.debug(f'[{self.timestamp}] {self.name} RECEIVED INV MESSAGE FOR {item.type} {item.item_id}')
+            log.debug('[{}] {} RECEIVED INV MESSAGE FOR {} {}', self.timestamp, self.name, item.type, item.item_id)
             if item.type == 'block':
                 if self.blockchain.get(item.item_id, None) is None:
-                    logger.debug(f'[{self.timestamp}] {self.name} RESPONDED WITH GETDATA')
-                    self.blockchain[item.item_id] = 'placeholder'  # not none
-                    self.send_to(self.outs[item.sender_id], GetDataMessage(item.item_id, item.type, self.id))
+                    log.debug('[{}] {} RESPONDED WITH GETDATA', self.timestamp, self.name)
+                    self.add_placeholder(item.item_id)
+                    block_type = 'cmpctblock' if self.compact_blocks else item.type
+                    self.send_to(self.outs[item.sender_id], GetDataMessage(item.item_id, block_type, self.id))
             elif item.type == 'tx':
                 if self.tx_ids.get(item.item_id, None) is None:
-                    logger.debug(f'[{self.timestamp}] {self.name} RESPONDED WITH GETDATA')
+                    log.debug('[{}] {} RESPONDED WITH GETDATA', self.timestamp, self.name)
                     self.tx_ids[item.item_id] = True
                     self.send_to(self.outs[item.sender_id], GetDataMessage(item.item_id, item.type, self.id))
         elif type(item) == GetDataMessage:
-            logger.debug(f'[{self.timestamp}] {self.name} RECEIVED GETDATA MESSAGE FOR {item.type} {item.item_id}')
+            log.debug('[{}] {} RECEIVED GETDATA MESSAGE FOR {} {}', self.timestamp, self.name, item.type, item.item_id)
             if item.type == 'block':
                 try:
                     self.send_to(self.outs[item.sender_id], self.blockchain[item.item_id])
                 except KeyError:
                     pass
+            elif item.type == 'cmpctblock':
+                block = self.blockchain.get(item.item_id, None)
+                if isinstance(block, Block):
+                    self.send_to(self.outs[item.sender_id], CompactBlockMessage(block, self.id))
             elif item.type == 'tx':
                 self.send_to(self.outs[item.sender_id], self.tx_ids[item.item_id])
+        elif type(item) == CompactBlockMessage:
+            log.debug('[{}] {} RECEIVED COMPACT BLOCK {}', self.timestamp, self.name, item.block.id)
+            if isinstance(self.blockchain.get(item.block.id, None), Block):
+                return
+            missing = [tx.id for tx in item.block.transactions if not self.tx_model.has_tx(self, tx)]
+            if self.tx_model.missing_block_size(self, item.block, missing) > 0:
+                log.debug('[{}] {} RESPONDED WITH GETBLOCKTXN FOR {}', self.timestamp, self.name, len(missing))
+                self.send_to(self.outs[item.sender_id], GetBlockTxnMessage(item.block.id, missing, self.id))
+            else:
+                log.info('[{}] {} RECEIVED BLOCK {}', self.timestamp, self.name, item.block.id)
+                self.mine_strategy.receive_block(self, item.block, relay=True)
+        elif type(item) == GetBlockTxnMessage:
+            log.debug('[{}] {} RECEIVED GETBLOCKTXN MESSAGE FOR {}', self.timestamp, self.name, item.block_id)
+            block = self.blockchain.get(item.block_id, None)
+            if isinstance(block, Block):
+                size = self.tx_model.missing_block_size(self, block, item.tx_ids)
+                self.send_to(self.outs[item.sender_id], BlockTxnMessage(block, item.tx_ids, size, self.id))
+        elif type(item) == BlockTxnMessage:
+            if isinstance(self.blockchain.get(item.block.id, None), Block):
+                return
+            requested = set(item.tx_ids)
+            for tx in item.block.transactions:
+                if tx.id in requested:
+                    self.tx_ids[tx.id] = tx
+            log.info('[{}] {} RECEIVED BLOCK {}', self.timestamp, self.name, item.block.id)
+            self.mine_strategy.receive_block(self, item.block, relay=True)
+        elif type(item) == InvBatchMessage:
+            log.debug('[{}] {} RECEIVED INV MESSAGE FOR {} {}S', self.timestamp, self.name, len(item.item_ids), item.type)
+            requested = [item_id for item_id in item.item_ids if self.tx_ids.get(item_id, None) is None]
+            if requested:
+                log.debug('[{}] {} RESPONDED WITH GETDATA FOR {}', self.timestamp, self.name, len(requested))
+                for item_id in requested:
+                    self.tx_ids[item_id] = True
+                self.send_to(self.outs[item.sender_id], GetDataBatchMessage(requested, item.type, self.id))
+        elif type(item) == GetDataBatchMessage:
+            log.debug('[{}] {} RECEIVED GETDATA MESSAGE FOR {} {}S', self.timestamp, self.name, len(item.item_ids), item.type)
+            peer = self.outs[item.sender_id]
+            for item_id in item.item_ids:
+                self.send_to(peer, self.tx_ids[item_id])
 
     def publish_item(self, item: Item, item_type: str):
         """
@@ -1,32 +1,187 @@
 import sys
-import heapq
+import math
 import random
 
+import numpy as np
+
 sys.path.append("..")
 
-from bitcoin.models import Miner, Block, Transaction
-from bitcoin.messages import InvMessage
+from typing import List, Dict, Tuple
+
+from bitcoin.models import Miner, Block, BTCBlock, Transaction, Mempool
+from bitcoin.messages import InvMessage, InvBatchMessage
 
-from loguru import logger
+from sim import log
+
+SIZE_MEAN, SIZE_STD = 509.23, 191.45  # https://tradeblock.com/bitcoin/historical/1w-f-tsize_per_avg-01101
+FEE_MEAN, FEE_STD = 7.17E-5, 7.53E-5  # https://www.blockchain.com/btc/blocks?page=1
+VALUE_MEAN, VALUE_STD = 1.1185684485714287, 2.2917997016339346  # same
+TX_SIZE = Transaction.SIZE
 
 
 class TxModel:
-    def __init__(self):
-        pass
+    def __init__(self, draw_chunk: int = 4096):
+        """
+        * draw_chunk (int): Number of transaction fees drawn at once for `create_batch`.
+        """
+        self.generates_tx = True
+        """
+        True if nodes generate their transactions in their own steps (with `generate_batch`), so they act at every step.
+        Models whose transactions have no effect until they are included in a block set it to False and generate the transactions
+        of all nodes when they are needed instead (see `catch_up`).
+        """
+        self.nodes: List[Miner] = []
+        """Nodes in the order they are stepped (see `register_node`)."""
+        self.node_indices: Dict[int, int] = dict()
+        self.generated_until: int = None
+        """Generation position (see `catch_up`) up to which transactions have been generated."""
+        self.draw_chunk = draw_chunk
+        self.rng: np.random.Generator = None
+        self.draws: np.ndarray = None
+        """Fees drawn in advance by `draw`. Not pickled; redrawn from `draws_state` when needed."""
+        self.draws_state: Tuple[dict, int] = None
+        """State of `rng` before `draws` were drawn, and their number."""
+        self.draw_pos = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['draws'] = None
+        return state
+
+    def reset(self):
+        """Reset state back to simulation start."""
+        self.generated_until = None
+        self.rng = None
+        self.draws = None
+        self.draws_state = None
+        self.draw_pos = 0
+
+    def register_node(self, node: Miner):
+        """
+        Perform initial setup for node. Called by the simulation when the node is added, in the order the nodes are stepped.
+        """
+        if node.id not in self.node_indices:
+            self.node_indices[node.id] = len(self.nodes)
+            self.nodes.append(node)
+
+    def catch_up(self, node: Miner) -> Tuple[int, int]:
+        """
+        Marks the transactions all nodes have generated by now as generated and returns their range `[start, end)` of generation positions.
+        The transactions of the node at index `idx` (see `register_node`) in step `step` are at position `step * len(nodes) + idx`,
+        so positions follow the order the transactions are generated in when every node is stepped at every step.
+        By now means up to the previous step for the nodes stepped after the given node, and up to the current step for the others.
+
+        Used by models that do not generate transactions in the nodes' steps (see `generates_tx`), before they need the transactions.
+        """
+        start = self.generated_until if self.generated_until is not None else len(self.nodes)  # nodes first generate in step 1
+        end = max(start, node.timestamp * len(self.nodes) + self.node_indices[node.id] + 1)
+        self.generated_until = end
+        return start, end
+
+    def count_txs(self, start: int, end: int) -> int:
+        """
+        Returns the number of transactions at the generation positions `[start, end)` (see `catch_up`).
+        """
+        counts = np.cumsum([0] + [node.tx_per_iter for node in self.nodes])
+        n = len(self.nodes)
+        return int((end // n - start // n) * counts[-1] + counts[end % n] - counts[start % n])
+
+    def tx_creators(self, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the creator ids and creation steps of the transactions at the generation positions `[start, end)` (see `catch_up`),
+        one element per transaction.
+        """
+        n = len(self.nodes)
+        positions = np.arange(start, end)
+        counts = np.array([node.tx_per_iter for node in self.nodes], dtype=np.int64)[positions % n]
+        ids = np.array([node.id for node in self.nodes], dtype=np.int64)[positions % n]
+        return np.repeat(ids, counts), np.repeat(positions // n, counts)
 
     def generate(self, node: Miner) -> Transaction:
-        size = random.gauss(509.23, 191.45)  # https://tradeblock.com/bitcoin/historical/1w-f-tsize_per_avg-01101
-        fee = random.gauss(7.17E-5, 7.53E-5)  # https://www.blockchain.com/btc/blocks?page=1
-        value = random.gauss(1.1185684485714287, 2.2917997016339346)  # same
+        size = random.gauss(SIZE_MEAN, SIZE_STD)
+        fee = random.gauss(FEE_MEAN, FEE_STD)
+        value = random.gauss(VALUE_MEAN, VALUE_STD)
         tx = Transaction(node.id, node.timestamp, size, value, fee)
         return tx
 
+    def generate_batch(self, node: Miner, count: int):
+        """
+        Generate `count` transactions for the node. Called by `bitcoin.models.Miner.step` once per step.
+        Calls `generate` `count` times unless overridden.
+        """
+        for _ in range(count):
+            self.generate(node)
+
+    def create_batch(self, node: Miner, count: int) -> List[Transaction]:
+        """
+        Create `count` transactions for the node at once, with fees drawn with NumPy (see `draw`).
+        Sizes and values are fixed (see `bitcoin.models.Transaction`), so they are not drawn.
+        """
+        return Transaction.batch(node.id, node.timestamp, self.draw(count))
+
+    def get_rng(self) -> np.random.Generator:
+        """
+        Returns the NumPy random generator of the model, seeded from `random` on first use (once the simulation has seeded it).
+        """
+        if self.rng is None:
+            self.rng = np.random.default_rng(random.getrandbits(64))
+        return self.rng
+
+    def draw(self, count: int) -> np.ndarray:
+        """
+        Returns the fees of `count` new transactions, drawn from the same distribution as in `generate`.
+        Fees are drawn for `draw_chunk` transactions of all nodes at once and handed out in order.
+        """
+        if self.draws is None and self.draws_state is not None:
+            # unpickled: draw the remaining fees again from the saved generator state
+            rng = np.random.default_rng()
+            rng.bit_generator.state, size = self.draws_state
+            self.draws = rng.normal(FEE_MEAN, FEE_STD, size=size)
+        if self.draws is None or self.draw_pos + count > len(self.draws):
+            size = max(count, self.draw_chunk)
+            self.draws_state = (self.get_rng().bit_generator.state, size)
+            self.draws = self.get_rng().normal(FEE_MEAN, FEE_STD, size=size)
+            self.draw_pos = 0
+        fees = self.draws[self.draw_pos:self.draw_pos + count]
+        self.draw_pos += count
+        return fees
+
     def publish(self, node: Miner, tx: Transaction, direct: bool = False):
         pass
 
+    def flush(self, node: Miner):
+        """
+        Called at the end of each step of the node, e.g. to send batched announcements.
+        """
+        pass
+
+    def next_action_time(self, node: Miner):
+        """
+        Returns the next step the model needs `flush` to be called at for the node, or None.
+        """
+        return None
+
     def receive(self, node: Miner, tx: Transaction = None):
         pass
 
+    def has_tx(self, node: Miner, tx: Transaction) -> bool:
+        """
+        Returns True if the node already has the transaction, so it need not be fetched to rebuild a compact block.
+        """
+        return False
+
+    def missing_block_size(self, node: Miner, block: Block, missing: List[int]) -> float:
+        """
+        Returns the number of bytes of a compact block the node has to fetch: the given missing transactions plus any block contents
+        not modeled as transactions (e.g. sampled block sizes with `tx_modeling: None`).
+        * node (Miner): Node rebuilding the block.
+        * block (Block): The compact block.
+        * missing (List[int]): Ids of the transactions the node does not have.
+        """
+        missing = set(missing)
+        known = sum(tx.size for tx in block.transactions if tx.id not in missing)
+        return block.size - BTCBlock.HEADER_SIZE - known
+
     def fill_block(self, node: Miner, block: Block) -> Block:
         pass
 
@@ -43,10 +198,14 @@ class TxModel:
 class NoneTxModel(TxModel):
     def __init__(self):
         super().__init__()
+        self.generates_tx = False
 
     def generate(self, node: Miner) -> Transaction:
         pass
 
+    def generate_batch(self, node: Miner, count: int):
+        pass
+
     def fill_block(self, node: Miner, block: Block) -> Block:
         """
         Assign tx count and total size to block.
@@ -60,9 +219,16 @@ class SimpleTxModel(TxModel):
     def __init__(self):
         """
         Initialize shared mempool.
+        Transactions only matter once they are included in a block, so they are generated when a block is filled (see `TxModel.catch_up`).
         """
         super().__init__()
-        self.mempool = []
+        self.generates_tx = False
+        self.mempool = Mempool()
+        self.updated_blocks = dict()
+
+    def reset(self):
+        super().reset()
+        self.mempool = Mempool()
         self.updated_blocks = dict()
 
     def generate(self, node: Miner) -> Transaction:
@@ -70,29 +236,157 @@ class SimpleTxModel(TxModel):
         Create transaction and add it to shared mempool.
         """
         tx = super().generate(node)
-        heapq.heappush(self.mempool, tx)
+        self.mempool.push(tx)
+
+    def generate_batch(self, node: Miner, count: int):
+        """
+        Create transactions at once and merge them into the shared mempool.
+        """
+        self.mempool.push_many(self.create_batch(node, count))
+
+    def generate_pending(self, node: Miner):
+        """
+        Create the transactions generated by all nodes since the last call (see `TxModel.catch_up`) and merge them into the shared mempool.
+        """
+        creators, steps = self.tx_creators(*self.catch_up(node))
+        self.mempool.push_many(Transaction.batch(creators, steps, self.draw(len(creators))))
 
     def fill_block(self, node: Miner, block: Block) -> Block:
         """
         Add txs to block from shared mempool until it reaches max size.
         """
+        self.generate_pending(node)
         while block.size < node.max_block_size:
             try:
-                block.add_tx(heapq.heappop(self.mempool))
+                block.add_tx(self.mempool.pop())
             except IndexError:
                 break
         return block
 
+    def has_tx(self, node: Miner, tx: Transaction) -> bool:
+        """
+        All nodes share the mempool, so every node has every transaction.
+        """
+        return True
+
     def get_mempool_size(self, node: Miner):
-        return sum([tx.size for tx in self.mempool])
+        self.generate_pending(node)
+        return self.mempool.size
 
     def get_waiting_tx_count(self, node: Miner):
+        self.generate_pending(node)
         return len(self.mempool)
 
 
+class StatisticalTxModel(TxModel):
+    """
+    Pending transactions are not created as objects. Instead, the model keeps a histogram of their feerates: the number of pending
+    transactions and their total fees in each feerate bucket, shared by all nodes like the mempool of `SimpleTxModel`.
+    Blocks are filled from the highest feerate buckets. Memory use does not depend on the number of transactions.
+
+    Fees follow the same normal distribution as in `TxModel.generate`. Transactions generated since the last update are counted
+    (see `TxModel.catch_up`) and added to the histogram at once with a multinomial draw over the buckets, so the cost of an update does
+    not depend on their number either.
+    """
+
+    def __init__(self, buckets: int = 64):
+        """
+        * buckets (int): Number of feerate buckets. They evenly divide the fee range within three standard deviations of the mean;
+        the first and last buckets also hold all lower and higher fees.
+        """
+        super().__init__()
+        self.generates_tx = False
+        edges = [-math.inf] + list(np.linspace(FEE_MEAN - 3 * FEE_STD, FEE_MEAN + 3 * FEE_STD, buckets - 1)) + [math.inf]
+        cdf = [0.5 * (1 + math.erf((edge - FEE_MEAN) / (FEE_STD * math.sqrt(2)))) for edge in edges]
+        pdf = [math.exp(-0.5 * ((edge - FEE_MEAN) / FEE_STD) ** 2) / math.sqrt(2 * math.pi) if math.isfinite(edge) else 0
+               for edge in edges]
+        self.probs = np.diff(cdf)
+        """Probability of a new transaction falling into each bucket."""
+        self.mean_fees = FEE_MEAN + FEE_STD * (np.array(pdf[:-1]) - np.array(pdf[1:])) / np.maximum(self.probs, 1e-300)
+        """Expected fee of a transaction in each bucket (mean of the normal distribution truncated to the bucket)."""
+        self.counts = np.zeros(buckets, dtype=np.int64)
+        """Number of pending transactions in each bucket, lowest feerates first."""
+        self.fees = np.zeros(buckets)
+        """Total fees of the pending transactions in each bucket."""
+        self.arrivals = 0
+
+    def reset(self):
+        super().reset()
+        self.counts[:] = 0
+        self.fees[:] = 0
+        self.arrivals = 0
+
+    def generate(self, node: Miner) -> Transaction:
+        """
+        Count a new transaction; it is added to the histogram at the next update.
+        """
+        self.arrivals += 1
+
+    def generate_batch(self, node: Miner, count: int):
+        self.arrivals += count
+
+    def update(self, node: Miner = None):
+        """
+        Add the transactions generated since the last update to the histogram.
+        * node (Miner): Node whose current step the transactions of all nodes are counted up to (see `TxModel.catch_up`).
+        """
+        if node is not None:
+            self.arrivals += self.count_txs(*self.catch_up(node))
+        if self.arrivals > 0:
+            added = self.get_rng().multinomial(self.arrivals, self.probs)
+            self.counts += added
+            self.fees += added * self.mean_fees
+            self.arrivals = 0
+
+    def fill_block(self, node: Miner, block: Block) -> Block:
+        """
+        Take transactions from the highest feerate buckets until the block reaches max size.
+        """
+        self.update(node)
+        remaining = max(0, math.ceil((node.max_block_size - block.size) / TX_SIZE))
+        for idx in reversed(range(len(self.counts))):
+            if remaining == 0:
+                break
+            taken = min(remaining, int(self.counts[idx]))
+            if taken == 0:
+                continue
+            fees = self.fees[idx] * taken / self.counts[idx]
+            self.counts[idx] -= taken
+            self.fees[idx] -= fees
+            block.tx_count += taken
+            block.size += taken * TX_SIZE
+            block.fees += fees
+            remaining -= taken
+        return block
+
+    def has_tx(self, node: Miner, tx: Transaction) -> bool:
+        return True
+
+    def missing_block_size(self, node: Miner, block: Block, missing: List[int]) -> float:
+        """
+        All nodes share the pending transactions, so compact blocks are always rebuilt without fetching anything.
+        """
+        return 0
+
+    def get_mempool_size(self, node: Miner):
+        self.update(node)
+        return int(self.counts.sum()) * TX_SIZE
+
+    def get_waiting_tx_count(self, node: Miner):
+        self.update(node)
+        return int(self.counts.sum())
+
+
 class FullTxModel(TxModel):
-    def __init__(self):
+    def __init__(self, inv_interval: int = 0, max_inv_ids: int = 1000):
+        """
+        * inv_interval (int): If positive, relayed transactions are announced in batches (trickling): ids are queued and
+        sent to all peers in `InvBatchMessage`s every `inv_interval` steps. If zero, each transaction is announced on its own right away.
+        * max_inv_ids (int): Maximum number of transaction ids in one batch.
+        """
         super().__init__()
+        self.inv_interval = inv_interval
+        self.max_inv_ids = max_inv_ids
 
     def generate(self, node: Miner) -> Transaction:
         """
@@ -101,31 +395,60 @@ class FullTxModel(TxModel):
         tx = super().generate(node)
         self.publish(node, tx, direct=True)
 
+    def generate_batch(self, node: Miner, count: int):
+        """
+        Create transactions at once and directly send them to all peers.
+        """
+        for tx in self.create_batch(node, count):
+            self.publish(node, tx, direct=True)
+
     def publish(self, node: Miner, tx: Transaction, direct: bool = False):
         """
         Send transaction either directly (without inv/getdata) or with inv/getdata to all peers
         """
+        if not direct and self.inv_interval > 0:
+            if not node.inv_queue:
+                node.inv_flush_at = node.timestamp + self.inv_interval
+            node.inv_queue.append(tx.id)
+            return
         msg = tx if direct else InvMessage(tx.id, 'tx', node.id)
         for peer in node.outs.values():
             node.send_to(peer, msg)
 
+    def flush(self, node: Miner):
+        """
+        Announce the queued transactions if their batch is due.
+        """
+        if node.inv_queue and node.timestamp >= node.inv_flush_at:
+            for start in range(0, len(node.inv_queue), self.max_inv_ids):
+                msg = InvBatchMessage(node.inv_queue[start:start + self.max_inv_ids], 'tx', node.id)
+                for peer in node.outs.values():
+                    node.send_to(peer, msg)
+            node.inv_queue = []
+
+    def next_action_time(self, node: Miner):
+        return node.inv_flush_at if node.inv_queue else None
+
     def receive(self, node: Miner, tx: Transaction = None):
         """
         Receive transaction, add it local mempool, save its receipt time, and relay to peers.
         """
-        logger.debug(f'[{node.timestamp}] {node.name} RECEIVED TX {tx.id}')
+        log.debug('[{}] {} RECEIVED TX {}', node.timestamp, node.name, tx.id)
         node.bookkeeper.save_tx(node, tx, node.timestamp)
         node.tx_ids[tx.id] = tx
-        heapq.heappush(node.mempool, tx)
+        node.mempool.push(tx)
         self.publish(node, tx, direct=False)  # relay
 
+    def has_tx(self, node: Miner, tx: Transaction) -> bool:
+        return isinstance(node.tx_ids.get(tx.id, None), Transaction)
+
     def fill_block(self, miner: Miner, block: Block) -> Block:
         """
         Fill block until reaching max block size.
         """
         while block.size < miner.max_block_size:
             try:
-                block.add_tx(heapq.heappop(miner.mempool))
+                block.add_tx(miner.mempool.pop())
             except IndexError:
                 break
         return block
@@ -136,14 +459,10 @@ class FullTxModel(TxModel):
         """
         for tx in block.transactions:
             # del node.tx_ids[tx.id]
-            try:
-                node.mempool.remove(tx)
-            except ValueError:
-                pass
-        heapq.heapify(node.mempool)
+            node.mempool.remove(tx)
 
     def get_mempool_size(self, node: Miner):
-        return sum([tx.size for tx in node.mempool])
+        return node.mempool.size
 
     def get_waiting_tx_count(self, node: Miner):
         return len(node.mempool)
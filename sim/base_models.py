@@ -6,22 +6,23 @@ from enum import Enum
 
 from loguru import logger
 
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 from sim import util
-from sim.network_util import get_delay, Region
+from sim.network_util import get_delay, link, Region
 
 
 class Item:
     """Represents objects that can be transmitted over a network (e.g. blocks, messages)."""
+    __slots__ = ('id', 'size', 'sender_id')
 
-    def __init__(self, sender_id: str, size: float):
+    def __init__(self, sender_id: int, size: float):
         """
         Create an Item object.
-        * sender_id (str): Id of the sender node. Can be used as a return address.
+        * sender_id (int): Id of the sender node. Can be used as a return address.
         * size (float): size of the item in bytes.
         """
-        self.id = util.generate_uuid()
+        self.id = util.generate_id()
         self.size = size
         self.sender_id = sender_id
 
@@ -29,12 +30,12 @@ class Item:
 class Block(Item):
     """Represents a block to be stored on the blockchain."""
 
-    def __init__(self, creator, prev_id: str, height: int):
+    def __init__(self, creator, prev_id: int, height: int):
         """
         Create a Block object.
 
         * miner (`Node`): Node that created the block.
-        * prev_id (str): Id of the block this block was mined on top of.
+        * prev_id (int): Id of the block this block was mined on top of.
         * height (int): Height of the block in the blockchain.
         """
         super().__init__(None, 0)
@@ -56,20 +57,79 @@ class Block(Item):
         return tx in self.transactions
 
     def __getstate__(self):
+        # sender_id and size are not saved
         state = self.__dict__.copy()
-        del state['sender_id']
-        del state['size']
+        state['id'] = self.id
         return state
 
     def __setstate__(self, state):
+        self.id = state.pop('id')
         self.__dict__.update(state)
 
     def __str__(self) -> str:
         return f'BLOCK (id:{self.id}, prev: {self.prev_id})'
 
 
+class BlockStore:
+    """
+    Blocks of a simulation, stored once and shared by all of its nodes.
+
+    Nodes reference the blocks they have seen in `Node.blockchain`. When a node is pickled, those references are replaced by block ids,
+    so saved nodes do not repeat the blocks; `attach` resolves them again against the loaded store.
+    """
+
+    def __init__(self):
+        self.blocks: Dict[int, Block] = dict()
+
+    def add(self, block: Block):
+        """
+        Store a block, keyed by its id.
+        """
+        self.blocks[block.id] = block
+
+    def get(self, block_id: int, default=None) -> Block:
+        return self.blocks.get(block_id, default)
+
+    def clear(self):
+        """
+        Remove all blocks, e.g. at the start of a new simulation run.
+        """
+        self.blocks.clear()
+
+    def attach(self, nodes: List['Node']):
+        """
+        Make the given (unpickled) nodes use this store, resolving the ids in their blockchains to blocks.
+        """
+        for node in nodes:
+            node.attach_store(self)
+
+    def __getitem__(self, block_id: int) -> Block:
+        return self.blocks[block_id]
+
+    def __contains__(self, block_id: int) -> bool:
+        return block_id in self.blocks
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+
+def block_ids(chain: Dict[int, Block]) -> Dict[int, str]:
+    """
+    Returns a copy of a blockchain dictionary with blocks replaced by None (placeholders are kept), for pickling without the blocks.
+    """
+    return {block_id: block if isinstance(block, str) else None for block_id, block in chain.items()}
+
+
+def resolve_block_ids(chain: Dict[int, str], block_store: BlockStore) -> Dict[int, Block]:
+    """
+    Inverse of `block_ids`: looks the blocks of a blockchain dictionary up in the given store.
+    """
+    return {block_id: block_store[block_id] if block is None else block for block_id, block in chain.items()}
+
+
 class Packet:
     """Wrapper class for transmitting `Item` objects over the network."""
+    __slots__ = ('payload', 'reveal_at')
 
     def __init__(self, payload: Item):
         """
@@ -89,47 +149,77 @@ class Node:
         * region (`sim.util.Region`): Geographic region of the node.
         * timestamp (int): Initial timestamp of the node. Defaults to zero.
         """
-        self.id = util.generate_uuid()
+        self.id = util.generate_id()
         self.name = name
         self.timestamp = timestamp
         self.region = region
         self.iter_seconds = iter_seconds
 
-        self.blockchain: Dict[str, Block] = dict()
-        """A dictionary that stores `BTCBlock` ids as keys and `BTCBlock`s as values."""
+        self.block_store = BlockStore()
+        """Store the node's blocks are kept in. Replaced by the simulation's shared store when the node is added to a simulation."""
+
+        self.blockchain: Dict[int, Block] = dict()
+        """A dictionary that stores `BTCBlock` ids as keys and `BTCBlock`s (from `block_store`) as values."""
+
+        self.head: Block = None
+        """Head of the longest chain in `blockchain`. Maintained by `add_block`."""
+
+        self.head_position = 0
+        """Position of the head's id among the keys of `blockchain`."""
+
+        self.placeholder_positions: Dict[int, int] = dict()
+        """Positions of the ids of requested blocks (see `add_placeholder`) among the keys of `blockchain`."""
 
         self.inbox: Dict[int, List[Packet]] = dict()
         """Node's inbox with simulation timestamps as keys and lists of `Item`s to be consumed at that timestamp as values."""
 
-        self.ins: Dict[str, Node] = dict()
+        self.ins: Dict[int, Node] = dict()
         """Dictionary storing incoming connections. Keys are `Node` ids and values are `Node`s."""
 
-        self.outs: Dict[str, Node] = dict()
+        self.outs: Dict[int, Node] = dict()
         """Dictionary storing outgoing connections. Keys are `Node` ids and values are `Node`s."""
 
-        self.last_reveal_times: Dict[str, int] = dict()
+        self.links: Dict[int, Tuple[float, float]] = dict()
+        """Dictionary storing the fixed latency and bandwidth (see `sim.network_util.link`) of each outgoing connection. Keys are `Node` ids."""
+
+        self.last_reveal_times: Dict[int, int] = dict()
         """
         Dictionary with node ids as keys and integers as values. Values correspond to the reveal time of the last message sent to the node with the given id.
         
         This is used to simulate links that can only  transmit one message at a time. A new message starts transmission only after the previous one has been received.
         """
 
+        self.scheduler = None
+        """`sim.scheduler.EventScheduler` to notify about incoming packets. Only set for event-driven simulations."""
+
     def __getstate__(self):
         """Return state values to be pickled."""
         state = self.__dict__.copy()
-        # Remove the unpicklable entries.
-        del state['ins']
-        del state['outs']
-        del state['inbox']
-        del state['timestamp']
+        # Remove the unpicklable entries (already absent if the node was itself unpickled).
+        for key in ['ins', 'outs', 'links', 'inbox', 'timestamp', 'scheduler', 'block_store']:
+            state.pop(key, None)
+        # Blocks are saved once with the block store; keep only their ids (see `attach_store`).
+        state['blockchain'] = block_ids(self.blockchain)
+        state['head'] = self.head.id if isinstance(self.head, Block) else self.head
         return state
 
     def __str__(self) -> str:
         return self.name
 
     def __setstate__(self, state):
-        """Restore state from the unpickled state values."""
+        """Restore state from the unpickled state values. Blocks stay ids until `attach_store` is called."""
         self.__dict__.update(state)
+        self.block_store = None
+
+    def attach_store(self, block_store: BlockStore):
+        """
+        Use the given block store, resolving the block ids left in `blockchain` and `head` by unpickling.
+        * block_store (`sim.base_models.BlockStore`): Store holding the node's blocks.
+        """
+        self.block_store = block_store
+        self.blockchain = resolve_block_ids(self.blockchain, block_store)
+        if self.head is not None and not isinstance(self.head, Block):
+            self.head = block_store[self.head]
 
     def step(self, seconds: float) -> List[Item]:
         """
@@ -142,16 +232,53 @@ class Node:
         except KeyError:
             return []
 
+    def next_action_time(self):
+        """
+        Returns the simulation step at which the node will next act on its own (i.e. not in response to an incoming packet), or None if it never does.
+        Used by `sim.scheduler.EventScheduler` to decide when to wake the node up.
+        """
+        return None
+
     def reset(self):
         """
         Reset node state back to simulation start, deleting connections as well.
         """
         self.timestamp = 0
         self.blockchain = dict()
+        self.head = None
+        self.head_position = 0
+        self.placeholder_positions = dict()
         self.inbox = dict()
         self.ins = dict()
         self.outs = dict()
+        self.links = dict()
         self.last_reveal_times = dict()
+        self.scheduler = None
+
+    def add_block(self, block: Block):
+        """
+        Store a block in the blockchain and update the head.
+        Among the blocks with the maximum height, the head is the one whose id was inserted into `blockchain` last (the id of a requested block is inserted with its placeholder).
+        * block (`sim.base_models.Block`): Block to add.
+        """
+        if isinstance(self.blockchain.get(block.id, None), Block):
+            self.blockchain[block.id] = block
+            return
+        position = self.placeholder_positions.pop(block.id, len(self.blockchain))
+        self.block_store.add(block)
+        self.blockchain[block.id] = block
+        if self.head is None or block.height > self.head.height or \
+                (block.height == self.head.height and position >= self.head_position):
+            self.head = block
+            self.head_position = position
+
+    def add_placeholder(self, block_id: int):
+        """
+        Store a placeholder for a requested block in the blockchain until the block itself arrives.
+        * block_id (int): Id of the requested block.
+        """
+        self.placeholder_positions[block_id] = len(self.blockchain)
+        self.blockchain[block_id] = 'placeholder'
 
     def send_to(self, node, item: Item):
         """
@@ -160,7 +287,11 @@ class Node:
         * item (`sim.base_models.Item`): Item to send.
         """
         packet = Packet(item)
-        delay = get_delay(self.region, node.region, item.size) / self.iter_seconds
+        try:
+            lat, speed = self.links[node.id]
+            delay = (lat + item.size / speed) / self.iter_seconds
+        except KeyError:
+            delay = get_delay(self.region, node.region, item.size) / self.iter_seconds
         reveal_time = math.ceil(max(self.timestamp, self.last_reveal_times.get(node.id, 0)) + delay)
         self.last_reveal_times[node.id] = reveal_time
         packet.reveal_at = reveal_time
@@ -168,6 +299,8 @@ class Node:
             node.inbox[packet.reveal_at].append(packet)
         except KeyError:
             node.inbox[packet.reveal_at] = [packet]
+        if node.scheduler is not None:
+            node.scheduler.wake(node, packet.reveal_at)
 
     def connect(self, *argv):
         """
@@ -176,6 +309,7 @@ class Node:
         """
         for node in argv:
             self.outs[node.id] = node
+            self.links[node.id] = link(self.region, node.region)
             node.ins[self.id] = self
 
     def print_blockchain(self, head: Block = None):
@@ -186,7 +320,9 @@ class Node:
 
 
 class Reward:
+    __slots__ = ('value', 'timestamp', 'node_id')
+
     def __init__(self, node: Node, value: int):
         self.value = value
         self.timestamp = node.timestamp
-        self.node = node
+        self.node_id = node.id
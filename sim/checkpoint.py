@@ -0,0 +1,139 @@
+"""
+Checkpoints of running simulations.
+
+Unlike the saved results, a checkpoint holds the complete state of a simulation run: nodes and blocks are pickled with all of their
+fields (connections, links, inboxes with the packets in flight, block sizes, ...) instead of through their `__getstate__`.
+
+A checkpoint directory contains two files:
+* `blocks.log`: the blocks of the run's `sim.base_models.BlockStore`, appended in batches. Each checkpoint only appends the blocks
+  created since the previous one.
+* `state`: everything else, with blocks referenced by id. Written to a temporary file and moved into place, so a crash while
+  checkpointing leaves the previous checkpoint intact. It records how much of `blocks.log` belongs to it.
+"""
+
+import os
+import pickle
+import itertools
+
+from typing import Any, Dict, Tuple
+
+from sim.base_models import Node, Block, BlockStore
+
+STATE_FILE = 'state'
+BLOCK_LOG = 'blocks.log'
+
+
+class Checkpointer:
+    """Writes the checkpoints of a simulation run to a directory."""
+
+    def __init__(self, path: str, logged: int = 0, log_size: int = 0):
+        """
+        * path (str): Checkpoint directory.
+        * logged (int): Number of blocks of the store already in the block log.
+        * log_size (int): Size of the block log in bytes as of the last checkpoint.
+        """
+        self.path = path
+        self.logged = logged
+        self.log_size = log_size
+
+    def save(self, step: int, state: Dict[str, Any], block_store: BlockStore):
+        """
+        Write a checkpoint, replacing the previous one.
+        * step (int): Last simulated step.
+        * state (Dict[str, Any]): Objects to save. Nodes among them are saved with all of their fields.
+        * block_store (`sim.base_models.BlockStore`): Store of the run. Blocks it holds are saved to the block log and referenced by id.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        log_path = os.path.join(self.path, BLOCK_LOG)
+        # blocks are only ever added to the store, so the ones not logged yet are at the end
+        blocks = list(itertools.islice(block_store.blocks.values(), self.logged, None))
+        with open(log_path, 'r+b' if os.path.exists(log_path) else 'wb') as f:
+            f.truncate(self.log_size)  # drop blocks appended by a checkpoint that did not complete
+            f.seek(self.log_size)
+            if blocks:
+                _BlockLogPickler(f).dump(blocks)
+            f.flush()
+            os.fsync(f.fileno())
+            log_size = f.tell()
+
+        state_path = os.path.join(self.path, STATE_FILE)
+        with open(f'{state_path}.tmp', 'wb') as f:
+            pickle.dump({'step': step, 'log_size': log_size}, f)
+            _StatePickler(f, block_store).dump(state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f'{state_path}.tmp', state_path)
+        self.logged += len(blocks)
+        self.log_size = log_size
+
+
+def exists(path: str) -> bool:
+    """
+    Returns True if the given directory holds a complete checkpoint.
+    """
+    return os.path.exists(os.path.join(path, STATE_FILE))
+
+
+def load(path: str) -> Tuple[int, Dict[str, Any], Checkpointer]:
+    """
+    Load the checkpoint in the given directory. Returns the last simulated step, the saved objects, and a `Checkpointer` that continues
+    writing checkpoints to the same directory.
+    * path (str): Checkpoint directory.
+    """
+    with open(os.path.join(path, STATE_FILE), 'rb') as f:
+        header = pickle.load(f)
+        blocks: Dict[int, Block] = dict()
+        with open(os.path.join(path, BLOCK_LOG), 'rb') as log:
+            while log.tell() < header['log_size']:
+                for block in pickle.load(log):
+                    blocks[block.id] = block
+        state = _StateUnpickler(f, blocks).load()
+    return header['step'], state, Checkpointer(path, len(blocks), header['log_size'])
+
+
+def _new_object(cls):
+    return cls.__new__(cls)
+
+
+def _set_full_state(obj, state: Tuple[dict, dict]):
+    obj.__dict__.update(state[0])
+    for name, value in state[1].items():
+        setattr(obj, name, value)
+
+
+def _reduce_full(obj):
+    # bypasses __getstate__, which leaves out fields not needed in the results (e.g. node connections, block sizes)
+    slots = {name: getattr(obj, name) for cls in type(obj).__mro__ for name in getattr(cls, '__slots__', ())
+             if name != '__dict__' and hasattr(obj, name)}
+    return _new_object, (type(obj),), (obj.__dict__, slots), None, None, _set_full_state
+
+
+class _StatePickler(pickle.Pickler):
+    def __init__(self, file, block_store: BlockStore):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.block_store = block_store
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Block) and self.block_store.get(obj.id) is obj:
+            return obj.id
+        return None
+
+    def reducer_override(self, obj):
+        return _reduce_full(obj) if isinstance(obj, (Node, Block)) else NotImplemented
+
+
+class _StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, blocks: Dict[int, Block]):
+        super().__init__(file)
+        self.blocks = blocks
+
+    def persistent_load(self, pid):
+        return self.blocks[pid]
+
+
+class _BlockLogPickler(pickle.Pickler):
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def reducer_override(self, obj):
+        return _reduce_full(obj) if isinstance(obj, Block) else NotImplemented
@@ -0,0 +1,46 @@
+"""
+Level-guarded logging for the simulation hot paths.
+
+The enabled levels are computed once by `set_level`, so a call at a disabled level only costs a function call.
+Messages are format strings with `{}` fields that are filled in with the given arguments only if the level is enabled.
+"""
+
+import sys
+
+from loguru import logger
+
+debug_enabled = True
+info_enabled = True
+success_enabled = True
+
+
+def set_level(level: str):
+    """
+    Replace the log handlers with a single stdout handler at the given level and update the enabled levels.
+    * level (str): Minimum loguru level to output (e.g. 'WARNING').
+    """
+    global debug_enabled, info_enabled, success_enabled
+    logger.remove()
+    logger.add(sys.stdout, level=level)
+    no = logger.level(level).no
+    debug_enabled = no <= logger.level('DEBUG').no
+    info_enabled = no <= logger.level('INFO').no
+    success_enabled = no <= logger.level('SUCCESS').no
+
+
+def debug(message: str, *args):
+    """Log a DEBUG message, formatting it with the given arguments only if the level is enabled."""
+    if debug_enabled:
+        logger.opt(depth=1).debug(message, *args)
+
+
+def info(message: str, *args):
+    """Log an INFO message, formatting it with the given arguments only if the level is enabled."""
+    if info_enabled:
+        logger.opt(depth=1).info(message, *args)
+
+
+def success(message: str, *args):
+    """Log a SUCCESS message, formatting it with the given arguments only if the level is enabled."""
+    if success_enabled:
+        logger.opt(depth=1).success(message, *args)
@@ -2,6 +2,8 @@
 Helper functions to perform network-layer calculations.
 """
 
+from typing import Tuple
+
 from sim.util import Region
 
 
@@ -12,9 +14,19 @@ def get_delay(a: Region, b: Region, size: float) -> float:
     * b (`sim.util.Region`): Destination region.
     * size (float): Message size in bytes.
     """
-    lat = latency(a, b)
-    trans = (size / speed(a, b))
-    return lat + trans
+    i, j = REGION_CODES[a], REGION_CODES[b]
+    return LATENCY_MATRIX[i][j] + size / SPEED_MATRIX[i][j]
+
+
+def link(a: Region, b: Region) -> Tuple[float, float]:
+    """
+    Returns the fixed latency (in seconds) and the bottleneck bandwidth (in bytes per second) between two regions
+    as precomputed in `LATENCY_MATRIX` and `SPEED_MATRIX`.
+    * a (`sim.util.Region`): Source region.
+    * b (`sim.util.Region`): Destination region.
+    """
+    i, j = REGION_CODES[a], REGION_CODES[b]
+    return LATENCY_MATRIX[i][j], SPEED_MATRIX[i][j]
 
 
 def latency(a: Region, b: Region) -> float:
@@ -135,4 +147,13 @@ LATENCY = {  # seconds
     (Region.NR, Region.VN): 165 * 0.001,
 
     (Region.VN, Region.VN): 0 * 0.001,
-}
\ No newline at end of file
+}
+
+REGION_CODES = {region: code for code, region in enumerate(Region)}
+"""Integer codes of the regions, used to index `LATENCY_MATRIX` and `SPEED_MATRIX`."""
+
+LATENCY_MATRIX = [[latency(a, b) for b in Region] for a in Region]
+"""Fixed latencies (in seconds) between all pairs of regions, indexed by region codes."""
+
+SPEED_MATRIX = [[speed(a, b) for b in Region] for a in Region]
+"""Bottleneck bandwidths (in bytes per second) between all pairs of regions, indexed by region codes."""
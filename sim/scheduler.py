@@ -0,0 +1,78 @@
+"""
+Discrete-event scheduling of node steps.
+"""
+
+import heapq
+
+from typing import List, Dict, Set, Tuple
+
+from sim.base_models import Node
+
+
+class EventScheduler:
+    """
+    Runs a simulation by jumping from one event to the next instead of stepping every node at every step.
+
+    An event is either a packet being revealed in a node's inbox or a node's next self-initiated action (see `sim.base_models.Node.next_action_time`).
+    At each event step, the nodes with pending events are stepped in the same order they would be in a tick-based run,
+    so the results are equivalent to calling `step` on every node at every step.
+    """
+
+    def __init__(self, nodes: List[Node], iter_seconds: float):
+        """
+        Create an EventScheduler object and attach it to the given nodes.
+        * nodes (List[`sim.base_models.Node`]): Nodes in the simulation. Nodes are stepped in this order within a step.
+        * iter_seconds (float): How many real-time seconds one simulation step corresponds to.
+        """
+        self.nodes = nodes
+        self.iter_seconds = iter_seconds
+        self.indices: Dict[int, int] = {node.id: idx for idx, node in enumerate(nodes)}
+
+        self.queue: List[Tuple[int, int]] = []  # heapq of (step, node index)
+        self.scheduled: Set[Tuple[int, int]] = set()
+
+        for node in nodes:
+            node.scheduler = self
+
+    def wake(self, node: Node, timestamp: int):
+        """
+        Schedule the given node to be stepped at the given step. Does nothing if `timestamp` is None.
+        * node (`sim.base_models.Node`): Node to wake up.
+        * timestamp (int): Step to wake the node up at.
+        """
+        if timestamp is None:
+            return
+        event = (timestamp, self.indices[node.id])
+        if event not in self.scheduled:
+            self.scheduled.add(event)
+            heapq.heappush(self.queue, event)
+
+    def run(self, until: int):
+        """
+        Process all events before the given step. Afterwards, all node timestamps are set to `until - 1`, as in a tick-based run of the same length.
+        * until (int): First step that is not simulated.
+        """
+        for node in self.nodes:
+            self.wake(node, node.next_action_time())
+
+        while self.queue and self.queue[0][0] < until:
+            timestamp = self.queue[0][0]
+            indices = []
+            while self.queue and self.queue[0][0] == timestamp:
+                event = heapq.heappop(self.queue)
+                self.scheduled.discard(event)
+                indices.append(event[1])
+
+            for idx in sorted(indices):
+                node = self.nodes[idx]
+                node.timestamp = timestamp - 1
+                node.step(self.iter_seconds)
+                self.wake(node, node.next_action_time())
+
+        for node in self.nodes:
+            node.timestamp = until - 1
+
+    def detach(self):
+        """Detach the scheduler from its nodes."""
+        for node in self.nodes:
+            node.scheduler = None
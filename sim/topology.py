@@ -0,0 +1,228 @@
+"""
+Builders for the peer-to-peer network graph.
+
+Each builder takes the regions of the nodes (one per node, in node order) and returns the undirected edges of the graph as pairs of
+node indices, without self-loops or duplicate edges. `k` is the number of connections each node initiates (`connections_per_node`),
+so every builder gives an average degree of about `2 * k`. Random choices are made with the `random` module, so graphs are reproducible
+under a fixed seed. All builders run in time roughly linear in the number of edges.
+"""
+
+import os
+import json
+import math
+import random
+import bisect
+import itertools
+
+from typing import List, Tuple, Set, Dict
+
+from sim.util import Region
+from sim.network_util import REGION_CODES, LATENCY_MATRIX
+
+Edge = Tuple[int, int]
+
+
+def random_k_out(regions: List[Region], k: int) -> List[Edge]:
+    """
+    Every node connects to `k` other nodes chosen uniformly at random (fewer if fewer are available).
+    Edges are returned in the order they are chosen, node by node.
+    * regions (List[`sim.util.Region`]): Regions of the nodes.
+    * k (int): Number of connections each node initiates.
+    """
+    n = len(regions)
+    adjacency = _Adjacency()
+    edges = []
+    for i in range(n):
+        for _ in range(min(k, n - 1 - adjacency.degree(i))):
+            j = _other(i, n)
+            while adjacency.has(i, j):
+                j = _other(i, n)
+            adjacency.add(i, j)
+            edges.append((i, j))
+    return edges
+
+
+def k_regular(regions: List[Region], k: int, attempts: int = 100) -> List[Edge]:
+    """
+    Random graph in which every node has exactly `2 * k` neighbors, as if each node initiated `k` connections.
+    `2 * k` must be smaller than the number of nodes.
+    Connection endpoints are paired at random, re-pairing only the endpoints that would form a self-loop or duplicate edge.
+    * regions (List[`sim.util.Region`]): Regions of the nodes.
+    * k (int): Number of connections each node initiates.
+    * attempts (int): Number of restarts before giving up.
+    """
+    n = len(regions)
+    degree = 2 * k
+    if degree >= n:
+        raise ValueError(f'No {degree}-regular graph with {n} nodes exists.')
+    for _ in range(attempts):
+        adjacency = _Adjacency()
+        edges = []
+        stubs = [i for i in range(n) for _ in range(degree)]
+        while stubs:
+            random.shuffle(stubs)
+            leftover = []
+            for i, j in zip(stubs[::2], stubs[1::2]):
+                if i != j and not adjacency.has(i, j):
+                    adjacency.add(i, j)
+                    edges.append((i, j))
+                else:
+                    leftover += [i, j]
+            if len(leftover) == len(stubs):
+                break
+            stubs = leftover
+        if not stubs:
+            return edges
+    raise ValueError(f'Could not build a {degree}-regular graph with {n} nodes in {attempts} attempts.')
+
+
+def small_world(regions: List[Region], k: int, rewire_prob: float) -> List[Edge]:
+    """
+    Watts-Strogatz graph: nodes on a ring connect to their `k` nearest neighbors on each side (`2 * k` in total),
+    then each edge is rewired to a random node with probability `rewire_prob`.
+    * regions (List[`sim.util.Region`]): Regions of the nodes.
+    * k (int): Number of ring neighbors on each side, i.e. connections each node initiates.
+    * rewire_prob (float): Probability of rewiring each edge.
+    """
+    n = len(regions)
+    half = min(k, (n - 1) // 2)
+    edges = [(i, (i + offset) % n) for offset in range(1, half + 1) for i in range(n)]
+    adjacency = _Adjacency()
+    for i, j in edges:
+        adjacency.add(i, j)
+    for idx, (i, j) in enumerate(edges):
+        if random.random() < rewire_prob and adjacency.degree(i) < n - 1:
+            target = _other(i, n)
+            while adjacency.has(i, target):
+                target = _other(i, n)
+            adjacency.remove(i, j)
+            adjacency.add(i, target)
+            edges[idx] = (i, target)
+    return edges
+
+
+def geographic(regions: List[Region], k: int) -> List[Edge]:
+    """
+    Every node connects to `k` other nodes, choosing peers in nearby regions more often:
+    the probability of choosing a peer is inversely proportional to the latency between the two regions (see `sim.network_util.LATENCY_MATRIX`).
+    Latencies below the smallest latency between two different regions (e.g. within a region) count as that smallest latency.
+    * regions (List[`sim.util.Region`]): Regions of the nodes.
+    * k (int): Number of connections each node initiates.
+    """
+    n = len(regions)
+    members: Dict[int, List[int]] = dict()
+    for i, region in enumerate(regions):
+        members.setdefault(REGION_CODES[region], []).append(i)
+    codes = list(members.keys())
+    floor = min(lat for row in LATENCY_MATRIX for lat in row if lat > 0)
+    # cumulative weights of choosing each region, per source region
+    cum_weights = {a: list(itertools.accumulate(len(members[b]) / max(LATENCY_MATRIX[a][b], floor) for b in codes))
+                   for a in codes}
+
+    adjacency = _Adjacency()
+    edges = []
+    for i, region in enumerate(regions):
+        weights = cum_weights[REGION_CODES[region]]
+        for _ in range(min(k, n - 1 - adjacency.degree(i))):
+            j = i
+            while j == i or adjacency.has(i, j):
+                peers = members[codes[bisect.bisect_right(weights, random.random() * weights[-1])]]
+                j = peers[math.floor(random.random() * len(peers))]
+            adjacency.add(i, j)
+            edges.append((i, j))
+    return edges
+
+
+TOPOLOGIES = {
+    'random': random_k_out,
+    'regular': k_regular,
+    'small_world': small_world,
+    'geographic': geographic,
+}
+"""Builders by the name used for the `topology` config value."""
+
+
+def build(name: str, regions: List[Region], k: int, rewire_prob: float = 0.1) -> List[Edge]:
+    """
+    Build a graph with the builder of the given name (see `TOPOLOGIES`).
+    * name (str): Builder name.
+    * regions (List[`sim.util.Region`]): Regions of the nodes.
+    * k (int): Connections per node.
+    * rewire_prob (float): Rewiring probability (only used by `small_world`).
+    """
+    if name not in TOPOLOGIES:
+        raise ValueError(f'Unknown topology {name}. Available topologies: {", ".join(TOPOLOGIES)}.')
+    if name == 'small_world':
+        return small_world(regions, k, rewire_prob)
+    return TOPOLOGIES[name](regions, k)
+
+
+def parameters(name: str, k: int, rewire_prob: float = 0.1) -> dict:
+    """
+    Returns the parameters `build` uses for a graph with the given builder, to save with the graph and check when loading it.
+    * name (str): Builder name.
+    * k (int): Connections per node.
+    * rewire_prob (float): Rewiring probability (only used by `small_world`).
+    """
+    params = {'topology': name, 'connections_per_node': k}
+    if name in ['regular', 'small_world']:
+        # graphs saved before these builders took the connections each node initiates have no degree and are rejected
+        params['degree'] = 2 * k
+    if name == 'small_world':
+        params['rewire_prob'] = rewire_prob
+    return params
+
+
+def save(path: str, regions: List[Region], edges: List[Edge], params: dict = None):
+    """
+    Save a graph as JSON, atomically.
+    * path (str): Target file.
+    * regions (List[`sim.util.Region`]): Regions of the nodes, saved to check the graph matches the nodes it is loaded for.
+    * edges (List[Edge]): Edges of the graph.
+    * params (dict): Parameters the graph was built with (see `parameters`), saved to check the graph matches the configuration it is loaded for.
+    """
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'regions': [region.value for region in regions], 'params': params, 'edges': edges}, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def load(path: str, regions: List[Region], params: dict = None) -> List[Edge]:
+    """
+    Load a graph saved with `save`. Raises ValueError if it was built for nodes in different regions or with different parameters.
+    Parameters are not checked if either the file or the caller does not specify them (e.g. for graphs written by hand).
+    * path (str): Graph file.
+    * regions (List[`sim.util.Region`]): Regions of the nodes to load the graph for.
+    * params (dict): Parameters the graph is expected to have been built with (see `parameters`).
+    """
+    with open(path, 'r') as f:
+        graph = json.load(f)
+    if graph['regions'] != [region.value for region in regions]:
+        raise ValueError(f'The graph in {path} was built for different nodes.')
+    if params is not None and graph.get('params', None) is not None and graph['params'] != params:
+        raise ValueError(f'The graph in {path} was built with {graph["params"]}, not {params}.')
+    return [(i, j) for i, j in graph['edges']]
+
+
+class _Adjacency:
+    def __init__(self):
+        self.neighbors: Dict[int, Set[int]] = dict()
+
+    def has(self, i: int, j: int) -> bool:
+        return j in self.neighbors.get(i, ())
+
+    def degree(self, i: int) -> int:
+        return len(self.neighbors.get(i, ()))
+
+    def add(self, i: int, j: int):
+        self.neighbors.setdefault(i, set()).add(j)
+        self.neighbors.setdefault(j, set()).add(i)
+
+    def remove(self, i: int, j: int):
+        self.neighbors[i].discard(j)
+        self.neighbors[j].discard(i)
+
+
+def _other(i: int, n: int) -> int:
+    # uniform over the n - 1 nodes other than i, drawing like random.choice(nodes[:i] + nodes[i + 1:])
+    j = random.randrange(n - 1)
+    return j if j < i else j + 1
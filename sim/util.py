@@ -27,3 +27,29 @@ def generate_uuid() -> str:
     return str(uuid.uuid4())
 
 
+_next = 0
+
+
+def generate_id() -> int:
+    """
+    Generate compact integer ids to use as `sim.base_models.Node` and `sim.base_models.Item` ids.
+    Ids are unique until `reset_ids` is called.
+    """
+    global _next
+    _next += 1
+    return _next - 1
+
+
+def reset_ids(start: int = 0):
+    """
+    Restart id generation from the given value. Called by the simulator at the start of each simulation run.
+    """
+    global _next
+    _next = start
+
+
+def next_id() -> int:
+    """
+    Returns the id `generate_id` will return next, without using it up (e.g. to restart id generation there with `reset_ids`).
+    """
+    return _next
@@ -0,0 +1,125 @@
+"""
+Runs a parameter sweep: every combination of config overrides, for every repetition, on a local process pool.
+
+Repetitions whose results already exist are skipped, so an interrupted sweep can be resumed by running the same command again.
+"""
+
+import os
+import random
+import argparse
+import itertools
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Tuple
+
+import yaml
+from loguru import logger
+
+from zelig import Simulation
+
+TOPOLOGY_KEYS = ['topology', 'connections_per_node', 'rewire_prob', 'nodes_in_each_region', 'nodes']
+"""Config keys the P2P network graph is built from. Cells that override any of them get their own `topology_file`."""
+
+
+class Sweep:
+    def __init__(self, sweep_file: str):
+        """
+        Create a Sweep object from a sweep file (see `sweep.yaml`).
+        * sweep_file (str): Path of the YAML sweep file.
+        """
+        with open(sweep_file, 'r') as f:
+            sweep = yaml.safe_load(f)
+        base_file = Path(sweep_file).parent / sweep['base']
+        with open(base_file, 'r') as f:
+            self.base = yaml.safe_load(f)
+        self.grid: Dict[str, list] = sweep.get('grid', dict())
+        self.variants: List[dict] = sweep.get('variants', [dict()])
+        self.workers = sweep.get('workers', 1)
+
+    def cells(self) -> List[Tuple[str, dict]]:
+        """
+        Returns the (name, config) pairs of the sweep: each variant combined with each point of the grid, applied on top of the base config.
+        """
+        keys = list(self.grid.keys())
+        cells = []
+        for variant in self.variants:
+            for values in itertools.product(*[self.grid[key] for key in keys]):
+                config = dict(self.base)
+                config.update(variant)
+                config.update(zip(keys, values))
+                if 'sim_name' in variant:
+                    parts = [variant['sim_name']]
+                else:
+                    parts = [self.base['sim_name']] + [f'{key}-{value}' for key, value in variant.items()]
+                parts += [f'{key}-{value}' for key, value in zip(keys, values)]
+                config['sim_name'] = '_'.join(parts).replace('/', '-')
+                if config.get('topology_file', None) is not None and \
+                        any(config.get(key, None) != self.base.get(key, None) for key in TOPOLOGY_KEYS):
+                    # the cell needs a different graph than the base config
+                    path = Path(config['topology_file'])
+                    config['topology_file'] = str(path.with_name(f'{path.stem}_{config["sim_name"]}{path.suffix}'))
+                cells.append((config['sim_name'], config))
+        return cells
+
+    def run(self, workers: int = None, seed: int = None) -> int:
+        """
+        Run all repetitions of all cells whose results do not exist yet. Returns the number of failed repetitions.
+        * workers (int): Number of processes to use. Overrides the `workers` value in the sweep file if given.
+        * seed (int): Seed to derive the seed of each repetition from. Each repetition gets the same seed no matter the order it runs in.
+        """
+        workers = workers if workers is not None else self.workers
+        jobs = []
+        for name, config in self.cells():
+            results_dir = config['results_directory']
+            Path(results_dir).mkdir(parents=True, exist_ok=True)
+            config_file = f'{results_dir}/{name}.yaml'
+            with open(f'{config_file}.tmp', 'w') as f:
+                yaml.safe_dump(config, f)
+            os.replace(f'{config_file}.tmp', config_file)
+            # build the graph up front, so that every repetition of the cell loads the same one
+            Simulation(config_file).save_topology(random.Random(f'{seed}:{name}').getrandbits(64) if seed is not None
+                                                  else random.getrandbits(64))
+
+            for rep in range(config['sim_reps']):
+                if os.path.exists(f'{results_dir}/{name}_{rep}/bookkeeper') or \
+                        os.path.exists(f'{results_dir}/{name}_{rep}/columnar'):
+                    continue
+                rep_seed = random.Random(f'{seed}:{name}:{rep}').getrandbits(64) if seed is not None \
+                    else random.getrandbits(64)
+                jobs.append((config_file, rep, rep_seed))
+
+        # simulations replace the log handlers with one at the log level of their config, which would drop the sweep's own messages
+        Simulation.set_log_level('WARNING')
+        logger.warning(f'Sweep: {len(jobs)} repetitions to run on {workers} processes.')
+        failed = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_run_rep, *job): job for job in jobs}
+            for done, future in enumerate(as_completed(futures), start=1):
+                config_file, rep, _ = futures[future]
+                try:
+                    future.result()
+                    logger.warning(f'Sweep: {done}/{len(jobs)} done ({config_file}, repetition {rep}).')
+                except Exception as e:
+                    failed += 1
+                    logger.error(f'Sweep: {config_file}, repetition {rep} failed: {e!r}')
+        return failed
+
+
+def _run_rep(config_file: str, rep: int, seed: int):
+    Simulation(config_file).run_rep(rep, seed, resume=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Blockchain simulator parameter sweep.")
+    parser.add_argument('-c', metavar='filename', default='sweep.yaml',
+                        help='Name of the YAML sweep file (default: sweep.yaml)')
+    parser.add_argument('-s', metavar='seed', type=int, help='Seed for random number generation')
+    parser.add_argument('-j', metavar='workers', type=int,
+                        help='Number of processes (default: workers value in the sweep file, or 1)')
+    args = parser.parse_args()
+
+    if args.c[-5:] != '.yaml':
+        print('Please provide a YAML file for the sweep.')
+        exit()
+    failures = Sweep(args.c).run(workers=args.j, seed=args.s)
+    exit(1 if failures else 0)
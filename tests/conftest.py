@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    """
+    Returns a function writing a small simulation config (config.yaml with the given overrides) to a temporary directory.
+    Results are saved under `tmp_path / 'dumps'`.
+    """
+    def make(**overrides) -> str:
+        with open(ROOT / 'config.yaml', 'r') as f:
+            config = yaml.safe_load(f)
+        config.update(sim_name='test', results_directory=str(tmp_path / 'dumps'), log_level='CRITICAL', sim_reps=1,
+                      sim_iters=3000, block_int_iters=300)
+        config.update(overrides)
+        path = tmp_path / f'{config["sim_name"]}.yaml'
+        with open(path, 'w') as f:
+            yaml.safe_dump(config, f)
+        return str(path)
+    return make
@@ -0,0 +1,23 @@
+import numpy as np
+
+from zelig import Simulation
+from bitcoin.analysis import Analysis, load_rep
+
+
+def test_stream_bookkeeping_gives_same_analysis_as_memory(make_config, tmp_path):
+    analyses = []
+    for bookkeeping in ['memory', 'stream']:
+        Simulation(make_config(sim_name=bookkeeping, bookkeeping=bookkeeping)).run_rep(0, 1)
+        analyses.append(Analysis(*load_rep(str(tmp_path / 'dumps' / f'{bookkeeping}_0'))))
+    memory, stream = analyses
+
+    assert len(memory.get_all_blocks()) > 0
+    assert list(memory.get_all_blocks()) == list(stream.get_all_blocks())
+    memory_summary, stream_summary = memory.summary(), stream.summary()
+    assert memory_summary['stale_rate'] == stream_summary['stale_rate']
+    assert memory_summary['rewards'] == stream_summary['rewards']
+    for percent, curve in memory_summary['percentile_delays'].items():
+        assert not np.all(np.isnan(curve))
+        np.testing.assert_array_equal(curve, stream_summary['percentile_delays'][percent])
+    for block in memory.get_all_blocks().values():
+        assert memory.block_prop_delays(block) == stream.block_prop_delays(block)
@@ -0,0 +1,48 @@
+import pytest
+
+from sim import checkpoint
+from zelig import Simulation
+from bitcoin.analysis import load_rep
+
+
+class Interrupt(Exception):
+    pass
+
+
+def summary(location: str):
+    bookkeeper, nodes = load_rep(location)
+    blocks = {block_id: (block.prev_id, block.miner, block.created_at, block.tx_count, block.fees)
+              for node in nodes for block_id, block in node.blockchain.items() if not isinstance(block, str)}
+    heads = {node.name: node.head.id for node in nodes}
+    return blocks, heads, bookkeeper.node_block_rcvs, bookkeeper.node_tx_rcvs
+
+
+@pytest.mark.parametrize('overrides', [
+    dict(tx_modeling='Simple'),
+    dict(tx_modeling='Simple', event_driven=True),
+    dict(tx_modeling='Statistical'),
+    dict(tx_modeling='Full', tx_per_node_per_iter=1),
+    dict(tx_modeling='Full', tx_per_node_per_iter=1, tx_inv_interval=5),
+    dict(tx_modeling='Full', tx_per_node_per_iter=1, event_driven=True),
+], ids=['tick', 'event_driven', 'statistical', 'full', 'full_inv', 'full_event_driven'])
+def test_resumed_run_matches_uninterrupted_run(make_config, tmp_path, monkeypatch, overrides):
+    Simulation(make_config(sim_name='whole', **overrides)).run_rep(0, 7)
+
+    config = make_config(sim_name='resumed', checkpoint_interval=1000, **overrides)
+    save = checkpoint.Checkpointer.save
+
+    def save_and_stop(self, *args, **kwargs):
+        save(self, *args, **kwargs)
+        raise Interrupt
+
+    monkeypatch.setattr(checkpoint.Checkpointer, 'save', save_and_stop)
+    with pytest.raises(Interrupt):
+        Simulation(config).run_rep(0, 7)
+    monkeypatch.setattr(checkpoint.Checkpointer, 'save', save)
+    Simulation(config).run_rep(0, 7, resume=True)
+
+    whole, resumed = summary(str(tmp_path / 'dumps' / 'whole_0')), summary(str(tmp_path / 'dumps' / 'resumed_0'))
+    assert len(whole[0]) > 2
+    assert resumed == whole
+    if overrides['tx_modeling'] == 'Full':
+        assert any(whole[3].values())
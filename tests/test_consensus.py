@@ -0,0 +1,14 @@
+from sim.util import Region
+from bitcoin.models import Miner
+from bitcoin.consensus import PoWOracle
+
+
+def test_scheduled_miner_can_mine_in_the_step_its_power_changes():
+    miner = Miner('MINER', 10, Region('US'), 0.1)
+    oracle = PoWOracle([miner], 1, 100, dynamic=True, scheduled=True)
+    # a lone miner with a block interval of one step finds a block at every step
+    miner.timestamp = 1
+    assert oracle.can_mine(miner)
+    miner.timestamp, miner.mine_power = 2, 20
+    assert oracle.can_mine(miner)
+    assert oracle.next_block_time(miner) == 3
@@ -0,0 +1,97 @@
+from sim.util import Region, reset_ids
+from zelig import Simulation
+from bitcoin.models import Miner, BTCBlock
+from bitcoin.tx_modelings import NoneTxModel
+from bitcoin.mining_strategies import HonestMining, SelfishMining
+from bitcoin.analysis import Analysis
+
+
+class PrivateChainSelfishMining(SelfishMining):
+    """
+    Selfish mining as implemented before withheld blocks were tracked separately: the private chain is a copy of the public blockchain
+    plus the blocks mined on it. Only publishing differs: blocks that are already public are not announced again.
+    """
+
+    def setup(self, node: Miner):
+        node.private_chain = node.blockchain.copy()
+        node.private_head = node.head
+        node.private_branch_len = 0
+
+    def generate_block(self, node: Miner, prev: BTCBlock = None) -> BTCBlock:
+        if prev is None:
+            prev = self.choose_head(node)
+        block = BTCBlock(node, prev.id, prev.height + 1)
+        block = node.tx_model.fill_block(node, block)
+        block.reward = node.consensus_oracle.get_reward(node)
+
+        node.block_store.add(block)
+        node.private_chain[block.id] = block
+        if node.private_head is None or block.height >= node.private_head.height:
+            node.private_head = block
+        node.bookkeeper.save_block(node, block, node.timestamp)
+        node.tx_model.update_mempool(node, block)
+
+        delta_prev = self.get_delta_prev(node)
+        node.private_branch_len += 1
+        if delta_prev == 0 and node.private_branch_len == 2:
+            self.publish_private_chain(node)
+            node.private_branch_len = 0
+        return block
+
+    def receive_block(self, node: Miner, block: BTCBlock, relay: bool = False, shallow=False):
+        if not shallow:
+            delta_prev = self.get_delta_prev(node)
+
+        super(SelfishMining, self).receive_block(node, block, relay=True)
+
+        if not shallow:
+            if delta_prev == 0:
+                self.setup(node)
+            else:
+                self.publish_private_chain(node)
+
+    def publish_private_chain(self, node: Miner):
+        for block in list(node.private_chain.values()):
+            if isinstance(block, BTCBlock) and not isinstance(node.blockchain.get(block.id, None), BTCBlock):
+                node.add_block(block)
+                node.publish_item(block, 'block')
+
+
+def run_selfish(tmp_path, selfish_mining: SelfishMining) -> Simulation:
+    reset_ids()
+    sim = Simulation()
+    sim.set_log_level('CRITICAL')
+    sim.name = type(selfish_mining).__name__
+    sim.results_dir = str(tmp_path)
+    sim.sim_iters = 30000
+    sim.block_int_iters = 100
+    sim.tx_modeling = NoneTxModel()
+    sim.connection_predicate = lambda n1, n2: True
+
+    selfish = Miner('SELFISH', 35, Region('US'), sim.iter_seconds)
+    selfish.mine_strategy = selfish_mining
+    sim.add_node(selfish)
+    for idx, region in enumerate(['US', 'CN', 'GE']):
+        honest = Miner(f'HONEST_{idx}', 65 / 3, Region(region), sim.iter_seconds)
+        honest.mine_strategy = HonestMining()
+        sim.add_node(honest)
+    sim.run_rep(0, 42)
+    return sim
+
+
+def test_selfish_mining_matches_private_chain_implementation(tmp_path):
+    new, old = run_selfish(tmp_path, SelfishMining()), run_selfish(tmp_path, PrivateChainSelfishMining())
+
+    blocks = {block_id: (block.prev_id, block.miner, block.created_at) for block_id, block in new.block_store.blocks.items()}
+    assert blocks == {block_id: (block.prev_id, block.miner, block.created_at) for block_id, block in old.block_store.blocks.items()}
+    for new_node, old_node in zip(new.nodes, old.nodes):
+        assert list(new_node.blockchain) == list(old_node.blockchain)
+        assert new_node.head.id == old_node.head.id
+        assert new.bookkeeper.get_node_block_rcvs(new_node) == old.bookkeeper.get_node_block_rcvs(old_node)
+    assert new.nodes[0].private_head.id == old.nodes[0].private_head.id
+    assert new.nodes[0].private_branch_len == old.nodes[0].private_branch_len
+
+    # the attack took place: the selfish miner won races and orphaned honest blocks
+    analysis = Analysis(new.bookkeeper, new.nodes)
+    assert analysis.reward_distribution().get('SELFISH', 0) > 0
+    assert any(analysis.get_all_blocks()[block_id].miner != 'SELFISH' for block_id in analysis.get_chain_index().orphans)
@@ -0,0 +1,15 @@
+import os
+
+from zelig import Simulation
+
+
+def test_node_dump_size_does_not_depend_on_node_count(make_config, tmp_path):
+    sizes = []
+    for count in [1, 4]:
+        # regular topology so every node has the same number of peers; no blocks so only the genesis block is in the chain
+        config = make_config(sim_name=f'nodes{count}', nodes_in_each_region=count, topology='regular', tx_modeling='Full',
+                             tx_per_node_per_iter=1, sim_iters=200, block_int_iters=10 ** 9)
+        Simulation(config).run_rep(0, 1)
+        sizes.append(os.path.getsize(tmp_path / 'dumps' / f'nodes{count}_0' / 'MINER_US_0'))
+    # ids and reveal times take a few more bytes in the larger network
+    assert sizes[1] < sizes[0] * 1.1
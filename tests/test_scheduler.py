@@ -0,0 +1,27 @@
+import pytest
+
+from sim.util import reset_ids
+from zelig import Simulation
+
+
+def run(config: str) -> Simulation:
+    reset_ids()
+    sim = Simulation(config)
+    sim.run_rep(0, 7)
+    return sim
+
+
+@pytest.mark.parametrize('tx_modeling', ['Simple', 'Statistical', 'Full', 'None'])
+def test_event_driven_run_matches_tick_run(make_config, tx_modeling):
+    # event-driven runs always schedule block times, so the tick run must draw them the same way
+    tick = run(make_config(sim_name='tick', tx_modeling=tx_modeling, scheduled_mining=True, event_driven=False))
+    event = run(make_config(sim_name='event', tx_modeling=tx_modeling, event_driven=True))
+
+    def blocks(sim: Simulation):
+        return {block_id: (block.prev_id, block.miner, block.created_at, block.size, block.fees, len(block.transactions))
+                for block_id, block in sim.block_store.blocks.items()}
+    assert len(tick.block_store.blocks) > 2
+    assert blocks(event) == blocks(tick)
+    for event_node, tick_node in zip(event.nodes, tick.nodes):
+        assert list(event_node.blockchain) == list(tick_node.blockchain)
+        assert event_node.head.id == tick_node.head.id
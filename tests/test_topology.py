@@ -0,0 +1,46 @@
+import pytest
+import yaml
+
+from sim import topology
+from sim.util import Region
+from sweep import Sweep
+
+
+def test_load_checks_build_parameters(tmp_path):
+    regions = [Region('US')] * 6
+    path = str(tmp_path / 'topology.json')
+    topology.save(path, regions, topology.build('random', regions, 2), topology.parameters('random', 2))
+    assert len(topology.load(path, regions, topology.parameters('random', 2))) > 0
+    with pytest.raises(ValueError):
+        topology.load(path, regions, topology.parameters('random', 4))
+
+
+@pytest.mark.parametrize('name', list(topology.TOPOLOGIES))
+def test_connections_per_node_gives_the_same_average_degree_in_every_topology(name):
+    regions = [Region('US'), Region('CN'), Region('GE')] * 20
+    edges = topology.build(name, regions, 3)
+    assert 2 * len(edges) / len(regions) == 6
+    if name == 'regular':
+        assert {sum(i in edge for edge in edges) for i in range(len(regions))} == {6}
+
+
+def test_sweep_cells_changing_the_graph_get_their_own_topology_file(make_config, tmp_path):
+    config = make_config(topology_file=str(tmp_path / 'topology.json'))
+    with open(tmp_path / 'sweep.yaml', 'w') as f:
+        yaml.safe_dump({'base': config, 'grid': {'connections_per_node': [2, 4], 'max_block_size': [10 ** 6, 2 * 10 ** 6]}}, f)
+    files = {name: cell['topology_file'] for name, cell in Sweep(str(tmp_path / 'sweep.yaml')).cells()}
+    # the base config has connections_per_node: 2
+    assert files['test_connections_per_node-2_max_block_size-1000000'] == str(tmp_path / 'topology.json')
+    assert files['test_connections_per_node-2_max_block_size-2000000'] == str(tmp_path / 'topology.json')
+    assert len({files['test_connections_per_node-4_max_block_size-1000000'],
+                files['test_connections_per_node-4_max_block_size-2000000'], str(tmp_path / 'topology.json')}) == 3
+
+
+def test_sweep_reports_failed_cells_whatever_the_log_level(make_config, tmp_path, capsys):
+    config = make_config(log_level='CRITICAL', sim_iters=100, topology_file=str(tmp_path / 'topology.json'))
+    with open(tmp_path / 'sweep.yaml', 'w') as f:
+        yaml.safe_dump({'base': config, 'workers': 1, 'grid': {'tx_modeling': ['None', 'Bogus']}}, f)
+    assert Sweep(str(tmp_path / 'sweep.yaml')).run(seed=1) == 1
+    output = capsys.readouterr().out
+    assert 'Sweep: 2 repetitions to run' in output
+    assert 'test_tx_modeling-Bogus.yaml, repetition 0 failed' in output
@@ -1,21 +1,28 @@
+import os
+import shutil
 import importlib
 import pickle
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Callable
+from typing import Callable, List
 
 import psutil
 import yaml
 import time
 from loguru import logger
 
-from sim.base_models import Node
-from sim.util import Region
+from sim import log, topology, checkpoint
+from sim.base_models import Node, BlockStore
+from sim.scheduler import EventScheduler
+from sim.util import Region, reset_ids, next_id
 from bitcoin.tx_modelings import *
 from bitcoin.models import Miner
 from bitcoin.mining_strategies import *
 from bitcoin.consensus import *
 from bitcoin.bookkeeper import *
+from bitcoin.columnar import save_columnar
 
 
 class Simulation:
@@ -35,75 +42,249 @@ class Simulation:
         self.config_file = config_file
         self.dynamic = False
         self.block_reward = 100
+        self.event_driven = False
+        self.scheduled_mining = False
+        self.batched_mining = False
+        self.workers = 1
+        self.results_format = 'pickle'
+        self.bookkeeping = 'memory'
+        self.tx_inv_interval = 0
+        self.tx_inv_max_ids = 1000
+        self.compact_blocks = False
+        self.topology = 'random'
+        self.rewire_prob = 0.1
+        self.topology_file = None
+        self.checkpoint_interval = 0
 
         self.bookkeeper = Bookkeeper()
+        self.block_store = BlockStore()
         self.nodes = []
         self.connection_predicate: Callable[[Node, Node], bool] = None
 
-    def run(self, report_time=False, track_perf=False):
-        cpu_percents, mem_percents = [], []
+    def run(self, report_time=False, track_perf=False, workers: int = None, resume=False):
+        """
+        Run all repetitions of the simulation.
+        * workers (int): Number of processes to run the repetitions on. Overrides the `workers` config value if given.
+        * resume (bool): Continue interrupted repetitions from their checkpoints and skip the ones that are done (see `run_rep`).
+        """
         if self.config_file is not None:
             self.__load_config_file(detailed=False)
+        if workers is not None:
+            self.workers = workers
 
-        iter_seconds = self.iter_seconds
         logger.warning(f'Simulation {self.name} ({self.sim_iters} iterations).')
-        for rep in range(self.sim_reps):
+        # derive one seed per repetition so results do not depend on the number of workers
+        seeds = [random.getrandbits(64) for _ in range(self.sim_reps)]
+        self.save_topology(seeds[0])
+        if self.workers > 1 and self.sim_reps > 1:
+            logger.warning(f'Running {self.sim_reps} repetitions on {min(self.workers, self.sim_reps)} processes.')
+            # with fork, workers inherit the simulation instead of unpickling it (nodes may hold lambdas)
+            context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+            with ProcessPoolExecutor(max_workers=min(self.workers, self.sim_reps), mp_context=context,
+                                     initializer=_init_worker, initargs=(self,)) as executor:
+                futures = [executor.submit(_run_rep, rep, seeds[rep], report_time, track_perf, resume)
+                           for rep in range(self.sim_reps)]
+                for future in futures:
+                    future.result()
+        else:
+            for rep in range(self.sim_reps):
+                self.run_rep(rep, seeds[rep], report_time, track_perf, resume)
+
+    def run_rep(self, rep: int, seed: int, report_time=False, track_perf=False, resume=False):
+        """
+        Run a single repetition of the simulation and save its results under `{results_dir}/{name}_{rep}`.
+        * rep (int): Index of the repetition.
+        * seed (int): Seed for random number generation in this repetition.
+        * resume (bool): Continue from the repetition's checkpoint if there is one, and skip it if its results already exist.
+        """
+        cpu_percents, mem_percents = [], []
+        iter_seconds = self.iter_seconds
+        random.seed(seed)
+        self.block_store.clear()
+        if self.config_file is not None:
+            self.__load_config_file(detailed=False)  # for the paths
+        sim_name = f'{self.name}_{rep}'
+        checkpoint_dir = f'{self.results_dir}/{sim_name}/checkpoint'
+        if resume and (os.path.exists(f'{self.results_dir}/{sim_name}/bookkeeper') or
+                       os.path.exists(f'{self.results_dir}/{sim_name}/columnar')):
+            logger.warning(f'Simulation {sim_name} is already done.')
+            return
+
+        start, scheduler, events_size = 0, None, 0
+        if resume and checkpoint.exists(checkpoint_dir):
+            start, state, checkpointer = checkpoint.load(checkpoint_dir)
+            self.nodes = state['nodes']
+            self.block_store = state['block_store']
+            self.bookkeeper = state['bookkeeper']
+            self.tx_modeling = state['tx_model']
+            scheduler = state['scheduler']
+            events_size = state['events_size']
+            random.setstate(state['random'])
+            reset_ids(state['next_id'])
+            logger.warning(f'Resuming simulation {sim_name} from step {start}.')
+        else:
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+            checkpointer = checkpoint.Checkpointer(checkpoint_dir)
             if self.config_file is not None:
+                reset_ids()
                 self.__load_config_file(detailed=True)
             else:
+                self.tx_modeling.reset()
                 [node.reset() for node in self.nodes]
-                for idx, n1 in enumerate(self.nodes):
-                    for n2 in self.nodes[:idx] + self.nodes[idx + 1:]:
-                        if self.connection_predicate(n1, n2):
-                            n1.connect(n2)
-                            n2.connect(n1)
+                if self.connection_predicate is not None:
+                    for n1 in self.nodes:
+                        for n2 in self.nodes:
+                            if n2 is not n1 and self.connection_predicate(n1, n2):
+                                n1.connect(n2)
+                                n2.connect(n1)
+                else:
+                    self.__setup_network()
                 self.__setup_mining()
 
-            start_time = time.time()
-            sim_name = f'{self.name}_{rep}'
-            logger.warning('Started simulation.')
-            for i in range(1, self.sim_iters):
+        streaming = isinstance(self.bookkeeper, StreamingBookkeeper)
+        if streaming:
+            Path(f'{self.results_dir}/{sim_name}').mkdir(parents=True, exist_ok=True)
+            self.bookkeeper.open(f'{self.results_dir}/{sim_name}/events.bin', keep=events_size)
+
+        start_time = time.time()
+        logger.warning('Started simulation.')
+        if self.event_driven:
+            if scheduler is None:
+                scheduler = EventScheduler(self.nodes, iter_seconds)
+            if self.checkpoint_interval > 0:
+                first = start - start % self.checkpoint_interval + self.checkpoint_interval
+                for step in range(first, self.sim_iters, self.checkpoint_interval):
+                    scheduler.run(step + 1)
+                    self.__save_checkpoint(checkpointer, step, scheduler)
+            scheduler.run(self.sim_iters)
+            scheduler.detach()
+            if track_perf:
+                cpu_percents.append(psutil.cpu_percent())
+                mem_percents.append(psutil.virtual_memory().percent)
+        else:
+            for i in range(start + 1, self.sim_iters):
                 [node.step(iter_seconds) for node in self.nodes]
                 if track_perf and i % 1000 == 0:
                     cpu_percents.append(psutil.cpu_percent())
                     mem_percents.append(psutil.virtual_memory().percent)
-            end_time = time.time()
+                if self.checkpoint_interval > 0 and i % self.checkpoint_interval == 0:
+                    self.__save_checkpoint(checkpointer, i, None)
+        end_time = time.time()
+        if streaming:
+            self.bookkeeper.close()
 
-            if report_time:
-                logger.warning(f'Total simulation time (s):\t{end_time - start_time}')
-                logger.warning(f'Average time per step (s):\t{(end_time - start_time) / self.sim_iters}')
-            if track_perf:
-                logger.warning(f'Average CPU:\t{round(sum(cpu_percents) / len(cpu_percents), 1)}%')
-                logger.warning(f'Maximum CPU:\t{round(max(cpu_percents), 1)}%')
-                logger.warning(f'Average MEM:\t{round(sum(mem_percents) / len(mem_percents), 1)}%')
-                logger.warning(f'Maximum MEM:\t{round(max(mem_percents), 1)}%')
+        if report_time:
+            logger.warning(f'Total simulation time (s):\t{end_time - start_time}')
+            logger.warning(f'Average time per step (s):\t{(end_time - start_time) / self.sim_iters}')
+        if track_perf and cpu_percents:
+            logger.warning(f'Average CPU:\t{round(sum(cpu_percents) / len(cpu_percents), 1)}%')
+            logger.warning(f'Maximum CPU:\t{round(max(cpu_percents), 1)}%')
+            logger.warning(f'Average MEM:\t{round(sum(mem_percents) / len(mem_percents), 1)}%')
+            logger.warning(f'Maximum MEM:\t{round(max(mem_percents), 1)}%')
 
-            logger.warning('Finished simulation. Saving nodes...')
-            Path(f'{self.results_dir}/{sim_name}').mkdir(parents=True, exist_ok=True)
+        logger.warning('Finished simulation. Saving nodes...')
+        Path(f'{self.results_dir}/{sim_name}').mkdir(parents=True, exist_ok=True)
+        if self.results_format == 'columnar':
+            save_columnar(f'{self.results_dir}/{sim_name}', self.nodes, self.bookkeeper)
+        else:
+            # nodes only keep the ids of their blocks; the blocks themselves are saved once
             for node in self.nodes:
                 with open(f'{self.results_dir}/{sim_name}/{node.name}', 'wb+') as f:
                     pickle.dump(node, f)
-            with open(f'{self.results_dir}/{sim_name}/bookkeeper', 'wb+') as f:
+            with open(f'{self.results_dir}/{sim_name}/blocks', 'wb+') as f:
+                pickle.dump(self.block_store, f)
+            # the bookkeeper is saved last and atomically; its presence marks a complete repetition
+            with open(f'{self.results_dir}/{sim_name}/bookkeeper.tmp', 'wb+') as f:
                 pickle.dump(self.bookkeeper, f)
-            logger.warning(
-                f'Simulation {sim_name} done. Saved nodes to {self.results_dir}/{sim_name}')
+            os.replace(f'{self.results_dir}/{sim_name}/bookkeeper.tmp', f'{self.results_dir}/{sim_name}/bookkeeper')
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        logger.warning(
+            f'Simulation {sim_name} done. Saved nodes to {self.results_dir}/{sim_name}')
+
+    def save_topology(self, seed: int):
+        """
+        Build the graph of the P2P network with the given seed and save it to `topology_file`, unless there is no `topology_file` or it
+        already exists. Called before running the repetitions, so that every repetition in every process loads the same graph.
+        * seed (int): Seed for random number generation while building the graph.
+        """
+        if self.config_file is not None:
+            self.__load_config_file(detailed=False)
+        if self.topology_file is None or os.path.exists(self.topology_file) or \
+                (self.config_file is None and self.connection_predicate is not None):
+            return
+        random.seed(seed)
+        regions = self.__node_regions()
+        topology.save(self.topology_file, regions,
+                      topology.build(self.topology, regions, self.connections_per_node, self.rewire_prob),
+                      self.__topology_params())
+
+    def __save_checkpoint(self, checkpointer: checkpoint.Checkpointer, step: int, scheduler: EventScheduler):
+        """Saves the complete state of the running repetition after the given step (see `sim.checkpoint`)."""
+        state = {
+            'nodes': self.nodes,
+            'block_store': self.block_store,
+            'bookkeeper': self.bookkeeper,
+            'tx_model': self.tx_modeling,
+            'scheduler': scheduler,
+            'events_size': self.bookkeeper.tell() if isinstance(self.bookkeeper, StreamingBookkeeper) else 0,
+            'random': random.getstate(),
+            'next_id': next_id(),
+        }
+        checkpointer.save(step, state, self.block_store)
+        logger.warning(f'Saved checkpoint at step {step}.')
 
     def add_node(self, node: Node):
         self.bookkeeper.register_node(node)
+        node.block_store = self.block_store
         node.tx_model = self.tx_modeling
         node.tx_per_iter = self.tx_per_node_per_iter
+        self.tx_modeling.register_node(node)
         node.max_block_size = self.max_block_size
+        node.compact_blocks = self.compact_blocks
         self.nodes.append(node)
 
     def __setup_mining(self):
         """Adds genesis block and sets up nodes' consensus oracles"""
-        pow_oracle = PoWOracle(self.nodes, self.block_int_iters, self.block_reward)
+        if self.batched_mining and (self.scheduled_mining or self.event_driven):
+            logger.warning('batched_mining is ignored in event-driven simulations.' if self.event_driven else
+                           'batched_mining and scheduled_mining are both set; scheduled_mining is ignored.')
+        if self.batched_mining and not self.event_driven:
+            pow_oracle = BatchedPoWOracle(self.nodes, self.block_int_iters, self.block_reward, dynamic=self.dynamic)
+        else:
+            pow_oracle = PoWOracle(self.nodes, self.block_int_iters, self.block_reward, dynamic=self.dynamic,
+                                   scheduled=self.event_driven or self.scheduled_mining)
         genesis_block = BTCBlock(Miner('satoshi', 0, None, 1), None, 0)
         for node in self.nodes:
             node.consensus_oracle = pow_oracle
             node.mine_strategy.receive_block(node, genesis_block, shallow=True)
             node.mine_strategy.setup(node)
 
+    def __setup_network(self):
+        """Connects the nodes according to `topology`, or to the graph saved in `topology_file` if it exists."""
+        regions = [node.region for node in self.nodes]
+        if self.topology_file is not None and os.path.exists(self.topology_file):
+            edges = topology.load(self.topology_file, regions, self.__topology_params())
+        else:
+            edges = topology.build(self.topology, regions, self.connections_per_node, self.rewire_prob)
+        for i, j in edges:
+            self.nodes[i].connect(self.nodes[j])
+            self.nodes[j].connect(self.nodes[i])
+
+    def __topology_params(self) -> dict:
+        return topology.parameters(self.topology, self.connections_per_node, self.rewire_prob)
+
+    def __node_regions(self) -> List[Region]:
+        """Returns the regions of the nodes of the simulation, in the order they are created."""
+        if self.config_file is None:
+            return [node.region for node in self.nodes]
+        with open(self.config_file, 'r') as f:
+            config = yaml.safe_load(f)
+        regions = []
+        for node in config['nodes']:
+            num_nodes = node['count'] if self.nodes_in_each_region == -1 else self.nodes_in_each_region
+            regions += [Region(node['region'])] * num_nodes
+        return regions
+
     def __load_config_file(self, detailed=False):
         with open(self.config_file, 'r') as f:
             config = yaml.safe_load(f)
@@ -120,11 +301,28 @@ class Simulation:
             self.connections_per_node = config['connections_per_node']
             self.dynamic = config['dynamic_difficulty']
             self.block_reward = config['block_reward']
+            self.event_driven = config.get('event_driven', False)
+            self.scheduled_mining = config.get('scheduled_mining', False)
+            self.batched_mining = config.get('batched_mining', False)
+            self.workers = config.get('workers', 1)
+            self.results_format = config.get('results_format', 'pickle')
+            self.bookkeeping = config.get('bookkeeping', 'memory')
+            self.tx_inv_interval = config.get('tx_inv_interval', 0)
+            self.tx_inv_max_ids = config.get('tx_inv_max_ids', 1000)
+            self.compact_blocks = config.get('compact_blocks', False)
+            self.topology = config.get('topology', 'random')
+            self.rewire_prob = config.get('rewire_prob', 0.1)
+            self.topology_file = config.get('topology_file', None)
+            self.checkpoint_interval = config.get('checkpoint_interval', 0)
+            if self.bookkeeping == 'stream' and not isinstance(self.bookkeeper, StreamingBookkeeper):
+                self.bookkeeper = StreamingBookkeeper()
+            elif self.bookkeeping == 'array' and not isinstance(self.bookkeeper, ArrayBookkeeper):
+                self.bookkeeper = ArrayBookkeeper()
             self.set_log_level(config['log_level'])
 
             if detailed:
                 TxClass = getattr(importlib.import_module('bitcoin.tx_modelings'), self.tx_modeling)
-                self.tx_modeling = TxClass()
+                self.tx_modeling = TxClass(self.tx_inv_interval, self.tx_inv_max_ids) if TxClass is FullTxModel else TxClass()
                 mine_strategy = HonestMining()
                 logger.warning('Creating nodes...')
                 self.nodes = []
@@ -138,20 +336,24 @@ class Simulation:
                         node.mine_strategy = mine_strategy
                 self.__setup_mining()
 
-                logger.warning('Setting up random P2P network...')
-                for node in self.nodes:
-                    node_index = self.nodes.index(node)
-                    first_part = self.nodes[:node_index]
-                    second_part = self.nodes[node_index + 1:]
-                    for i in range(self.connections_per_node):
-                        n2 = random.choice(first_part + second_part)
-                        node.connect(n2)
-                        n2.connect(node)
+                logger.warning(f'Setting up {self.topology} P2P network...')
+                self.__setup_network()
 
     @staticmethod
     def set_log_level(level: str):
-        logger.remove()
-        logger.add(sys.stdout, level=level)
+        log.set_level(level)
+
+
+_worker_simulation: Simulation = None
+
+
+def _init_worker(simulation: Simulation):
+    global _worker_simulation
+    _worker_simulation = simulation
+
+
+def _run_rep(rep: int, seed: int, report_time: bool, track_perf: bool, resume: bool):
+    _worker_simulation.run_rep(rep, seed, report_time, track_perf, resume)
 
 
 if __name__ == "__main__":
@@ -159,6 +361,10 @@ if __name__ == "__main__":
     parser.add_argument('-c', metavar='filename', default='config.yaml',
                         help='Name of the YAML configuration file (default: config.yaml)')
     parser.add_argument('-s', metavar='seed', type=int, help='Seed for random number generation')
+    parser.add_argument('-j', metavar='workers', type=int,
+                        help='Number of processes to run repetitions on (default: workers value in the config file, or 1)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue interrupted repetitions from their checkpoints (see checkpoint_interval) and skip finished ones')
     args = parser.parse_args()
     config_name = args.c
     seed = args.s
@@ -169,4 +375,4 @@ if __name__ == "__main__":
     if seed is not None:
         random.seed(seed)
     sim = Simulation(config_name)
-    sim.run(report_time=True, track_perf=True)
+    sim.run(report_time=True, track_perf=True, workers=args.j, resume=args.resume)